@@ -0,0 +1,495 @@
+#!/usr/bin/env python3
+
+# MIT License
+
+# Copyright (c) 2019 Pipin Fitriadi
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from argparse import ArgumentParser
+from json import dump, load
+from os.path import getsize, join
+from random import Random
+from string import ascii_letters, digits, punctuation
+from sys import stdout
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from tracemalloc import get_traced_memory, start, stop
+from unittest import TestCase
+
+from dna_health import min_max_dna_health
+from string_searching import (
+    AhoCorasick,
+    SEARCH_ENGINES,
+    Searcher,
+    ShardedMatcher
+)
+
+"""
+Benchmark of string_searching.AhoCorasick and dna_health.min_max_dna_health
+over seeded synthetic data, so every run measures the same inputs.
+
+Every case reports build time, scan throughput in MB/s (UTF-8 size of the
+text), matches per second and peak memory traced by tracemalloc, as JSON:
+
+    python benchmark.py --output baseline.json
+    python benchmark.py --baseline baseline.json
+
+With --baseline the run exits with status 1 when a case is slower, or uses
+more memory, than the baseline by more than --tolerance.
+"""
+
+ALPHABETS = {
+    'dna': 'acgt',
+    'ascii': ascii_letters + digits + punctuation + ' ',
+    'unicode': (
+        'αβγδεζηθικλμνξοπρστυφχψω'
+        'абвгдежзийклмнопрстуфхцчшщ'
+        '的一是不了人我在有他这中大来上'
+    )
+}
+
+# name: (alphabet, number of keys, key length range, text length, density).
+# Density is the share of the text made of planted keys. The dna backend
+# only runs on the dna alphabet.
+SCENARIOS = {
+    'dna-many-short-dense': ('dna', 5000, (3, 8), 200000, 0.5),
+    'dna-few-long-sparse': ('dna', 10, (50, 200), 200000, 0.01),
+    'ascii-many-short-sparse': ('ascii', 20000, (4, 12), 200000, 0.05),
+    'ascii-few-long-dense': ('ascii', 20, (40, 100), 200000, 0.5),
+    'unicode-many-short-dense': ('unicode', 5000, (2, 6), 100000, 0.5),
+    'unicode-few-long-sparse': ('unicode', 10, (20, 60), 100000, 0.01)
+}
+
+# Numbers of shards of bench_shards.
+SHARDS = [1, 2, 4, 8]
+
+ENGINES = [
+    ('node', 'lazy'),
+    ('node', 'dfa'),
+    ('array', 'lazy'),
+    ('array', 'dfa'),
+    ('dna', 'lazy')
+]
+
+
+def generate_keys(
+    rng: Random,
+    alphabet: str,
+    count: int,
+    length: tuple
+) -> list:
+    return [
+        ''.join(
+            rng.choices(
+                alphabet,
+                k=rng.randint(*length)
+            )
+        )
+        for _ in range(count)
+    ]
+
+
+def generate_text(
+    rng: Random,
+    alphabet: str,
+    length: int,
+    keys: list = (),
+    density: float = 0.0
+) -> str:
+    """
+    Random text over alphabet where about density of the characters come
+    from keys planted at random positions.
+    """
+    parts = []
+    size = 0
+
+    while size < length:
+        if keys and rng.random() < density:
+            part = rng.choice(keys)
+        else:
+            part = ''.join(
+                rng.choices(
+                    alphabet,
+                    k=rng.randint(1, 16)
+                )
+            )
+
+        parts.append(part)
+        size += len(part)
+
+    return ''.join(parts)[:length]
+
+
+def generate_dna_input(
+    rng: Random,
+    path: str,
+    genes: int,
+    strands: int,
+    strand_length: int
+):
+    """
+    Write a Determining DNA Health input file to path.
+    """
+    names = generate_keys(rng, ALPHABETS['dna'], genes, (1, 10))
+
+    with open(path, 'w') as content:
+        content.write(f'{genes}\n')
+        content.write(' '.join(names) + '\n')
+        content.write(
+            ' '.join(
+                str(
+                    rng.randint(0, 10 ** 7)
+                )
+                for _ in range(genes)
+            ) + '\n'
+        )
+        content.write(f'{strands}\n')
+
+        for _ in range(strands):
+            first = rng.randint(0, genes - 1)
+            last = rng.randint(first, genes - 1)
+            strand = generate_text(
+                rng,
+                ALPHABETS['dna'],
+                strand_length,
+                names,
+                0.3
+            )
+            content.write(f'{first} {last} {strand}\n')
+
+
+def peak_memory(function, *args) -> int:
+    start()
+
+    try:
+        function(*args)
+        return get_traced_memory()[1]
+    finally:
+        stop()
+
+
+def best_time(repeat: int, function, *args, **kwargs) -> tuple:
+    """
+    Return the best wall time of repeat calls and the last result.
+    """
+    best = None
+
+    for _ in range(repeat):
+        t0 = perf_counter()
+        result = function(*args, **kwargs)
+        elapsed = perf_counter() - t0
+
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return best, result
+
+
+def bench_aho_corasick(
+    seed: int = 0,
+    scale: float = 1.0,
+    repeat: int = 3
+) -> dict:
+    results = {}
+
+    for name, (alphabet, count, length, text_length, density) in (
+        SCENARIOS.items()
+    ):
+        rng = Random(f'{seed}:{name}')
+        keys = generate_keys(
+            rng,
+            ALPHABETS[alphabet],
+            max(int(count * scale), 1),
+            length
+        )
+        text = generate_text(
+            rng,
+            ALPHABETS[alphabet],
+            max(int(text_length * scale), 1),
+            keys,
+            density
+        )
+        megabytes = len(text.encode('utf-8')) / 1e6
+
+        for backend, mode in ENGINES:
+            if backend == 'dna' and alphabet != 'dna':
+                continue
+
+            build, aho_corasick = best_time(
+                repeat,
+                AhoCorasick,
+                keys,
+                mode,
+                backend=backend
+            )
+            scan, found = best_time(repeat, aho_corasick.find_in, text)
+            matches = sum(map(len, found.values()))
+            results[f'aho_corasick/{name}/{backend}-{mode}'] = {
+                'build_seconds': build,
+                'scan_seconds': scan,
+                'scan_mb_per_second': megabytes / scan if scan else None,
+                'matches': matches,
+                'matches_per_second': matches / scan if scan else None,
+                'peak_memory_bytes': peak_memory(
+                    lambda: AhoCorasick(
+                        keys,
+                        mode,
+                        backend=backend
+                    ).find_in(text)
+                )
+            }
+
+    return results
+
+
+def bench_searcher(
+    seed: int = 0,
+    scale: float = 1.0,
+    repeat: int = 3
+) -> dict:
+    """
+    Every Searcher engine, forced, and the automatic choice on the
+    scenarios with few keys.
+    """
+    results = {}
+
+    for name, (alphabet, count, length, text_length, density) in (
+        SCENARIOS.items()
+    ):
+        if count > 100:
+            continue
+
+        rng = Random(f'{seed}:{name}')
+        keys = generate_keys(rng, ALPHABETS[alphabet], count, length)
+        text = generate_text(
+            rng,
+            ALPHABETS[alphabet],
+            max(int(text_length * scale), 1),
+            keys,
+            density
+        )
+
+        for engine in ('auto',) + SEARCH_ENGINES:
+            searcher = Searcher(keys, engine)
+            scan, found = best_time(repeat, searcher.find_in, text)
+            results[f'searcher/{name}/{engine}'] = {
+                'engine': searcher.engine,
+                'scan_seconds': scan,
+                'matches': sum(map(len, found.values()))
+            }
+
+    return results
+
+
+def bench_shards(
+    seed: int = 0,
+    scale: float = 1.0,
+    repeat: int = 3
+) -> dict:
+    """
+    ShardedMatcher over the same keys split into more and more shards:
+    bytes per shard file and peak memory of a sequential scan, against
+    its throughput.
+    """
+    rng = Random(f'{seed}:shards')
+    keys = generate_keys(
+        rng,
+        ALPHABETS['ascii'],
+        max(int(50000 * scale), 1),
+        (4, 12)
+    )
+    text = generate_text(
+        rng,
+        ALPHABETS['ascii'],
+        max(int(200000 * scale), 1),
+        keys,
+        0.05
+    )
+    megabytes = len(text.encode('utf-8')) / 1e6
+    results = {}
+
+    for shards in SHARDS:
+        with TemporaryDirectory() as directory:
+            build, matcher = best_time(
+                1,
+                ShardedMatcher.build,
+                keys,
+                directory,
+                shards
+            )
+            scan, _ = best_time(repeat, matcher.find_in, text)
+            results[f'shards/{shards}'] = {
+                'build_seconds': build,
+                'shard_bytes': max(map(getsize, matcher.paths)),
+                'scan_seconds': scan,
+                'scan_mb_per_second': megabytes / scan if scan else None,
+                'peak_memory_bytes': peak_memory(matcher.find_in, text)
+            }
+
+    return results
+
+
+def bench_dna_health(
+    seed: int = 0,
+    scale: float = 1.0,
+    repeat: int = 3
+) -> dict:
+    rng = Random(f'{seed}:dna_health')
+
+    with TemporaryDirectory() as directory:
+        path = join(directory, 'input.txt')
+        generate_dna_input(
+            rng,
+            path,
+            max(int(20000 * scale), 1),
+            max(int(20000 * scale), 1),
+            100
+        )
+        elapsed, _ = best_time(repeat, min_max_dna_health, path)
+        return {
+            'dna_health/min_max_dna_health': {
+                'seconds': elapsed,
+                'peak_memory_bytes': peak_memory(min_max_dna_health, path)
+            }
+        }
+
+
+def run(seed: int = 0, scale: float = 1.0, repeat: int = 3) -> dict:
+    results = bench_aho_corasick(seed, scale, repeat)
+    results.update(
+        bench_searcher(seed, scale, repeat)
+    )
+    results.update(
+        bench_shards(seed, scale, repeat)
+    )
+    results.update(
+        bench_dna_health(seed, scale, repeat)
+    )
+    return {
+        'seed': seed,
+        'scale': scale,
+        'repeat': repeat,
+        'results': results
+    }
+
+
+def compare(current: dict, baseline: dict, tolerance: float) -> list:
+    """
+    Return a description of every time or memory metric of current that
+    is worse than the same metric of baseline by more than tolerance.
+    """
+    regressions = []
+
+    for case, metrics in current['results'].items():
+        for metric, value in metrics.items():
+            if not (
+                metric.endswith('_seconds')
+                or metric == 'seconds'
+                or metric == 'peak_memory_bytes'
+            ):
+                continue
+
+            old = baseline['results'].get(case, {}).get(metric)
+
+            if old and value > old * (1 + tolerance):
+                regressions.append(
+                    f'{case} {metric}: {old:.6g} -> {value:.6g}'
+                )
+
+    return regressions
+
+
+class Test(TestCase):
+    def test_generate_is_seeded(self):
+        def generate(seed):
+            rng = Random(seed)
+            keys = generate_keys(rng, 'acgt', 10, (2, 4))
+            return keys, generate_text(rng, 'acgt', 100, keys, 0.5)
+
+        self.assertEqual(generate(1), generate(1))
+        self.assertEqual(
+            len(
+                generate(1)[1]
+            ),
+            100
+        )
+
+    def test_compare(self):
+        baseline = {'results': {'a': {'scan_seconds': 1.0, 'matches': 5}}}
+        current = {'results': {'a': {'scan_seconds': 1.5, 'matches': 9}}}
+
+        self.assertEqual(compare(current, baseline, 0.6), [])
+        self.assertEqual(
+            compare(current, baseline, 0.1),
+            ['a scan_seconds: 1 -> 1.5']
+        )
+
+    def test_run(self):
+        self.assertEqual(
+            set(
+                run(scale=0.001, repeat=1)['results']
+            ),
+            {
+                f'aho_corasick/{name}/{backend}-{mode}'
+                for name in SCENARIOS
+                for backend, mode in ENGINES
+                if backend != 'dna' or name.startswith('dna-')
+            } | {
+                f'searcher/{name}/{engine}'
+                for name in SCENARIOS
+                if SCENARIOS[name][1] <= 100
+                for engine in ('auto',) + SEARCH_ENGINES
+            } | {
+                f'shards/{shards}'
+                for shards in SHARDS
+            } | {'dna_health/min_max_dna_health'}
+        )
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(
+        description='Benchmark AhoCorasick and min_max_dna_health.'
+    )
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--scale', type=float, default=1.0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='write the JSON report here')
+    parser.add_argument('--baseline', help='JSON report to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.1)
+    arguments = parser.parse_args()
+
+    report = run(arguments.seed, arguments.scale, arguments.repeat)
+
+    if arguments.output:
+        with open(arguments.output, 'w') as content:
+            dump(report, content, indent=2)
+    else:
+        dump(report, stdout, indent=2)
+        print()
+
+    if arguments.baseline:
+        with open(arguments.baseline) as content:
+            regressions = compare(report, load(content), arguments.tolerance)
+
+        for regression in regressions:
+            print(regression)
+
+        if regressions:
+            raise SystemExit(1)
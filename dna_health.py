@@ -22,182 +22,237 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-from collections import defaultdict
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from io import StringIO
+from itertools import islice
+from multiprocessing import get_all_start_methods, get_context
+from os import cpu_count
+from os.path import join
+from tempfile import TemporaryDirectory
 from unittest import main, TestCase
 
+from string_searching import AhoCorasick, AutomatonCache, BASES
+
 """
 Hackerrank: Determining DNA Health
 URL: https://www.hackerrank.com/challenges/determining-dna-health/problem
 
 Try to be solved by Pipin Fitriadi (pipinfitriadi@gmail.com) at May 21th 2019,
 updated at May 28th 2019.
+
+All genes go in one string_searching.AhoCorasick built once. Every gene
+keeps the sorted indices where it appears and the prefix sums of their
+health as payload, so the health of a strand for genes [first, last] is
+a bisect per distinct gene found.
 """
 
 
-class Node:
-    def __init__(
-        self,
-        key='',
-        in_keys=False,
-        suffix=None,
-        key_suffix=None,
-        health=0
-    ):
-        self.key = key
-        self.in_keys = in_keys
-        self.suffix: Node = suffix
-        self.key_suffix: Node = key_suffix
-        self.childs = set()
-        self.health = health
-
-
-class AhoCorasick:
-    def __init__(self, keys: list):
-        self.tree = self.build_tree(keys)
-
-    def build_tree(self, keys: list) -> Node:
-        keys = sorted(keys)
-        root = {}
-        root[''] = Node()
-        keys_name = [key for key, _ in keys]
-
-        for key, health in keys:
-            for k in range(
-                len(key)
-            ):
-                current_key = key[:k+1]
-
-                if current_key not in root:
-                    root[current_key] = Node(
-                        current_key,
-                        current_key in keys_name
-                    )
-
-                if key == current_key:
-                    root[current_key].health = health
-
-                parent_key = current_key[:-1]
-
-                if parent_key not in root:
-                    root[parent_key] = Node(
-                        parent_key,
-                        parent_key in keys_name
-                    )
-
-                if key == parent_key:
-                    root[current_key].health = health
-
-                root[parent_key].childs.add(
-                    root[current_key]
-                )
+def build_automaton(
+    genes: list,
+    healths: array,
+    automata: AutomatonCache = None
+) -> AhoCorasick:
+    """
+    AhoCorasick over the distinct genes, whose payload is the sorted list
+    of indices of the gene and the prefix sums of their health: the k-th
+    prefix sum is the total health of the first k indices. Genes made of
+    the BASES only use the dna backend, whose table has one column per
+    base. Given automata, the automaton is taken from or added to that
+    cache.
+    """
+    payloads = {}
+
+    for index, (gene, health) in enumerate(zip(genes, healths)):
+        indices, prefix_healths = payloads.setdefault(gene, ([], [0]))
+        indices.append(index)
+        prefix_healths.append(
+            prefix_healths[-1] + health
+        )
 
-        for key in root:
-            for k in range(
-                len(key)
-            ):
-                suffix = key[k+1:]
+    options = {}
 
-                if suffix in root:
-                    root[key].suffix = root[suffix]
+    if set(''.join(payloads)) <= set(BASES):
+        options['backend'] = 'dna'
 
-                    for s in range(
-                        len(suffix)
-                    ):
-                        key_suffix = suffix[s:]
+    if automata is None:
+        return AhoCorasick(payloads, **options)
 
-                        if key_suffix in keys_name:
-                            root[key].key_suffix = root[key_suffix]
-                            break
+    return automata.get(payloads, **options)
 
-                    break
 
-        return root['']
+def strand_health(
+    aho_corasick: AhoCorasick,
+    strand: str,
+    first: int,
+    last: int
+) -> int:
+    """
+    Total health of the genes with index in [first, last] found in
+    strand, every occurrence counted.
+    """
+    total_health = 0
 
-    def find_in(self, text: str) -> dict:
-        output = 0
-        node = self.tree
+    for gene, count in aho_corasick.count_in(strand).items():
+        indices, prefix_healths = aho_corasick.payloads[gene]
+        lo = bisect_left(indices, first)
+        hi = bisect_right(indices, last)
 
-        for i, t in enumerate(text):
-            while node:
-                for child in node.childs:
-                    key = child.key
+        if hi > lo:
+            total_health += count * (
+                prefix_healths[hi] - prefix_healths[lo]
+            )
 
-                    if key[-1:] == t:
-                        if child.in_keys:
-                            output += child.health
+    return total_health
 
-                        key_suffix = child.key_suffix
 
-                        if key_suffix:
-                            while key_suffix:
-                                key = key_suffix.key
-                                output += key_suffix.health
-                                key_suffix = key_suffix.key_suffix
+def read_genes(content) -> tuple:
+    """
+    Read the header of an open input file: the genes as a list and their
+    health as an array('q').
+    """
+    content.readline()
+    genes = content.readline().split()
+    healths = array(
+        'q',
+        map(
+            int,
+            content.readline().split()
+        )
+    )
+    return genes, healths
 
-                        node = child
-                        is_found = True
-                        break
-                else:
-                    node = node.suffix
-                    is_found = False
 
-                if is_found:
-                    break
-            else:
-                node = self.tree
+def iter_strands(content):
+    """
+    Lazily yield (first, last, strand) for every strand line following
+    the header of an open input file, one line at a time.
+    """
+    for _ in range(
+        int(
+            content.readline()
+        )
+    ):
+        first, last, strand = content.readline().split()
+        yield int(first), int(last), strand
+
+
+# Automaton of the worker processes of min_max_dna_health. Set before the
+# pool starts so forked workers inherit it instead of rebuilding it.
+worker_automaton = None
+
+
+def load_worker_automaton(genes: list, healths: array):
+    global worker_automaton
+
+    if worker_automaton is None:
+        worker_automaton = build_automaton(genes, healths)
+
+
+def min_max_strands(strands: list) -> tuple:
+    total_healths = [
+        strand_health(worker_automaton, strand, first, last)
+        for first, last, strand in strands
+    ]
+    return min(total_healths), max(total_healths)
+
+
+def iter_min_max_strands(
+    aho_corasick: AhoCorasick,
+    genes: list,
+    healths: array,
+    strands,
+    workers: int,
+    chunksize: int
+):
+    """
+    Yield the (min, max) health of every chunk of strands, computed by a
+    pool of worker processes. At most two chunks per worker are pending,
+    so strands are read from the file only as fast as they are scanned.
+    """
+    global worker_automaton
+
+    chunks = iter(
+        lambda: list(
+            islice(strands, chunksize)
+        ),
+        []
+    )
+    context = None
 
-        return output
+    if 'fork' in get_all_start_methods():
+        context = get_context('fork')
 
+    worker_automaton = aho_corasick
 
-def min_max_dna_health(file_path: str) -> tuple:
-    with open(file_path, 'r') as content:
-        lines = content.readlines()
+    try:
+        with ProcessPoolExecutor(
+            workers,
+            mp_context=context,
+            initializer=load_worker_automaton,
+            initargs=(genes, healths)
+        ) as executor:
+            pending = deque()
 
-    genes = list(
-        map(
-            tuple,
-            zip(
-                lines[1].rstrip().split(),
-                list(
-                    map(
-                        int,
-                        lines[2].rstrip().split()
-                    )
+            for chunk in chunks:
+                pending.append(
+                    executor.submit(min_max_strands, chunk)
+                )
+
+                if len(pending) >= 2 * workers:
+                    yield pending.popleft().result()
+
+            while pending:
+                yield pending.popleft().result()
+    finally:
+        worker_automaton = None
+
+
+def min_max_dna_health(
+    file_path: str,
+    workers: int = 1,
+    chunksize: int = 1000,
+    automata: AutomatonCache = None
+) -> tuple:
+    """
+    Health of the least and most healthy strands of an input file. Runs
+    on the same genes and healths can share their automaton through an
+    AutomatonCache given as automata.
+    """
+    with open(file_path, 'r') as content:
+        genes, healths = read_genes(content)
+        aho_corasick = build_automaton(genes, healths, automata)
+        strands = iter_strands(content)
+
+        if workers == 1:
+            min_max_healths = (
+                (total_health, total_health)
+                for total_health in (
+                    strand_health(aho_corasick, strand, first, last)
+                    for first, last, strand in strands
                 )
             )
-        )
-    )
-    min_health = -1
-    max_health = -1
+        else:
+            min_max_healths = iter_min_max_strands(
+                aho_corasick,
+                genes,
+                healths,
+                strands,
+                workers or cpu_count() or 1,
+                chunksize
+            )
 
-    for s_itr in range(
-        int(
-            lines[3]
-        )
-    ):
-        first_last_d = lines[s_itr + 4].split()
-        s_gene = defaultdict(int)
-
-        for gene, health in genes[
-            int(
-                first_last_d[0]
-            ):int(
-                first_last_d[1]
-            ) + 1
-        ]:
-            s_gene[gene] += health
-
-        total_health = AhoCorasick(
-            s_gene.items()
-        ).find_in(
-            first_last_d[2]
-        )
+        min_health = -1
+        max_health = -1
 
-        if min_health == -1 or total_health < min_health:
-            min_health = total_health
+        for low, high in min_max_healths:
+            if min_health == -1 or low < min_health:
+                min_health = low
 
-        if max_health == -1 or total_health > max_health:
-            max_health = total_health
+            if max_health == -1 or high > max_health:
+                max_health = high
 
     return min_health, max_health
 
@@ -215,115 +270,136 @@ class Test(TestCase):
             (3218660, 11137051)
         )
 
-    # def test_3(self):
-    #     self.assertEqual(
-    #         min_max_dna_health('../input13.txt'),
-    #         (40124729287, 61265329670)
-    #     )
+    def test_read_input(self):
+        content = StringIO(
+            '3\n'
+            'a b aa\n'
+            '1 2 3\n'
+            '2\n'
+            '0 2 aab\n'
+            '1 1 bb\n'
+        )
+        genes, healths = read_genes(content)
 
-    # def test_4(self):
-    #     self.assertEqual(
-    #         min_max_dna_health('../input30.txt'),
-    #         (12317773616, 12317773616)
-    #     )
+        self.assertEqual(genes, ['a', 'b', 'aa'])
+        self.assertEqual(healths, array('q', [1, 2, 3]))
+        self.assertEqual(
+            list(
+                iter_strands(content)
+            ),
+            [(0, 2, 'aab'), (1, 1, 'bb')]
+        )
 
+    def test_ranges(self):
+        # Genes a and ab come back at several indices, and the ranges of
+        # the strands overlap.
+        lines = (
+            '6\n'
+            'a ab a b ab a\n'
+            '1 2 4 8 16 32\n'
+            '6\n'
+            '0 5 abab\n'
+            '1 3 abab\n'
+            '2 2 aab\n'
+            '3 5 bab\n'
+            '4 4 xyz\n'
+            '0 2 ba\n'
+        )
 
-from time import time
+        for b in ['b', 'c']:
+            content = StringIO(
+                lines.replace('b', b)
+            )
+            aho_corasick = build_automaton(*read_genes(content))
 
+            self.assertEqual(
+                aho_corasick.backend,
+                'node' if b == 'b' else 'dna'
+            )
+            self.assertEqual(
+                [
+                    strand_health(aho_corasick, strand, first, last)
+                    for first, last, strand in iter_strands(content)
+                ],
+                [126, 28, 8, 64, 0, 5]
+            )
 
-def timer_genes_1(file_path: str):
-    with open(file_path, 'r') as content:
-        lines = content.readlines()
+        with TemporaryDirectory() as directory:
+            path = join(directory, 'input.txt')
 
-    t0 = time()
-    genes = list(
-        map(
-            tuple,
-            zip(
-                lines[1].rstrip().split(),
-                list(
-                    map(
-                        int,
-                        lines[2].rstrip().split()
-                    )
+            with open(path, 'w') as content:
+                content.write(lines)
+
+            self.assertEqual(min_max_dna_health(path), (0, 126))
+
+    def test_workers(self):
+        with TemporaryDirectory() as directory:
+            path = join(directory, 'input.txt')
+
+            with open(path, 'w') as content:
+                content.write(
+                    '6\n'
+                    'a b c aa d b\n'
+                    '1 2 3 4 5 6\n'
+                    '3\n'
+                    '1 5 caaab\n'
+                    '0 4 xyz\n'
+                    '2 4 bcdybc\n'
                 )
+
+            self.assertEqual(
+                min_max_dna_health(path, workers=2, chunksize=1),
+                min_max_dna_health(path)
+            )
+            self.assertEqual(
+                min_max_dna_health(path),
+                (0, 19)
             )
-        )
-    )
-    t1 = time()
-    return t1 - t0
 
+            automata = AutomatonCache()
 
-def timer_genes_2(file_path: str):
-    with open(file_path, 'r') as content:
-        lines = content.readlines()
+            for _ in range(2):
+                self.assertEqual(
+                    min_max_dna_health(path, automata=automata),
+                    (0, 19)
+                )
 
-    t0 = time()
-    genes = lines[1].rstrip().split()
-    health = list(
-        map(
-            int,
-            lines[2].rstrip().split()
-        )
-    )
-    genes = list(
-        map(
-            tuple,
-            zip(
-                genes,
-                health
-            )
+            self.assertEqual(automata.info()['hits'], 1)
+
+    def test_nucleotides(self):
+        genes = ['a', 'c', 'g', 't', 'ac', 'ca', 'a']
+        healths = array('q', [1, 2, 4, 8, 16, 32, 64])
+        aho_corasick = build_automaton(genes, healths)
+        node = AhoCorasick(aho_corasick.payloads)
+
+        self.assertEqual(aho_corasick.backend, 'dna')
+
+        for strand in ['acca', 'gattaca', 'acxca', 'nnn', '']:
+            for first, last in [(0, 6), (1, 5), (4, 4)]:
+                self.assertEqual(
+                    strand_health(aho_corasick, strand, first, last),
+                    strand_health(node, strand, first, last)
+                )
+
+        self.assertEqual(
+            strand_health(aho_corasick, 'acxca', 0, 6),
+            2 * (1 + 64) + 2 * 2 + 16 + 32
         )
-    )
-    t1 = time()
-    return t1 - t0
 
+    def test_3(self):
+        self.assertEqual(
+            min_max_dna_health('../input13.txt'),
+            (40124729287, 61265329670)
+        )
 
-def timer_genes_3(file_path: str):
-    with open(file_path, 'r') as content:
-        lines = content.readlines()
-
-    t0 = time()
-    genes = lines[1].rstrip().split()
-    healths = list(map(int, lines[2].rstrip().split()))
-    gMap = defaultdict(lambda: [[], [0]])
-    subs = set()
-
-    for id, gene in enumerate(genes):
-        gMap[gene][0].append(id)
-
-        for j in range(1, min(len(gene), 500)+1):
-            subs.add(gene[:j])
-
-    for v in gMap.values():
-        for i, ix in enumerate(v[0]):
-            v[1].append(v[1][i]+healths[ix])
-    t1 = time()
-    return t1 - t0
-
-def run_test():
-    for i in ['00', '01', '13', '30']:
-        path = f'../input{i}.txt'
-        tg1 = timer_genes_1(path)
-        tg2 = timer_genes_2(path)
-        tg3 = timer_genes_3(path)
-
-        if tg1 <= tg2:
-            if tg1 <= tg3:
-                print('tg1')
-            else:
-                print('tg3')
-        else:
-            if tg2 <= tg3:
-                print('tg2')
-            else:
-                print('tg3')
+    def test_4(self):
+        self.assertEqual(
+            min_max_dna_health('../input30.txt'),
+            (12317773616, 12317773616)
+        )
 
-        print()
 
 if __name__ == '__main__':
-    # main()
-
     import os
 
     os.chdir(
@@ -332,4 +408,4 @@ if __name__ == '__main__':
         )
     )
 
-    run_test()
+    main()
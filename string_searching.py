@@ -22,8 +22,317 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-from collections import defaultdict
-from unittest import main, TestCase
+from array import array
+from bisect import bisect_left
+from collections import defaultdict, deque
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait
+)
+from hashlib import blake2b
+from io import StringIO
+from itertools import islice
+from mmap import ACCESS_READ, mmap as memory_map
+from os import cpu_count, fstat, listdir
+from os.path import join
+from random import Random
+from struct import Struct
+from sys import byteorder, getsizeof
+from tempfile import TemporaryDirectory
+from threading import Lock
+from time import perf_counter
+from unittest import main, skipIf, TestCase
+from zlib import crc32
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Largest alphabet for which AhoCorasick(keys, mode='dfa') resolves
+# every transition at build time. Bigger alphabets fall back to the
+# lazy failure-link walk, because the table grows with states * alphabet.
+DFA_MAX_ALPHABET = 256
+
+# Binary layout written by AhoCorasick.save: magic, format version,
+# byte order, table item size, flags, number of states, edges,
+# alphabet characters and keys, then the byte length of the alphabet
+# and key blobs. Bump FORMAT_VERSION whenever the layout changes.
+FORMAT_MAGIC = b'AHOCORAS'
+FORMAT_VERSION = 2
+FORMAT_HEADER = Struct('<8sHBBIQQQQQQ')
+FORMAT_DFA = 1
+FORMAT_BINARY = 2
+
+# Binary layout written by SuffixArray.save: magic, format version, byte
+# order, item size of the suffix array, binary flag, text length and byte
+# length of the text blob, followed by the blob and the suffix array.
+SUFFIX_MAGIC = b'SUFFIXAR'
+SUFFIX_VERSION = 1
+SUFFIX_HEADER = Struct('<8sHBBBQQ')
+
+# Characters (or bytes, for binary automata) read per block by
+# AhoCorasick.iter_file_matches.
+BLOCK_SIZE = 1 << 20
+
+# Match kinds of AhoCorasick.iter_matches and find_in: every overlapping
+# occurrence, or non-overlapping matches scanned from left to right where
+# the leftmost start wins and ties go to the longest key or to the key
+# given first.
+MATCH_KINDS = ('standard', 'leftmost-longest', 'leftmost-first')
+
+# Engines of Searcher. Up to SEARCH_FIND_MAX_KEYS keys, one str.find
+# pass per key beat the AhoCorasick DFA on 1 MB texts, DNA included.
+SEARCH_ENGINES = ('aho-corasick', 'shift-and', 'find')
+SEARCH_FIND_MAX_KEYS = 16
+
+# Nucleotides of NucleotideAutomaton. BASE_CODES translates every byte to
+# the index of its base, or to UNKNOWN_BASE, BASE_BLOCK characters at a
+# time by base_runs; PACKED_CODES maps a byte of pack_bases to the codes
+# of its four bases, which CODE_BASES translates back to bases.
+BASES = 'acgt'
+UNKNOWN_BASE = 4
+BASE_CODES = bytes(
+    BASES.index(chr(b)) if chr(b) in BASES else UNKNOWN_BASE
+    for b in range(256)
+)
+BASE_BLOCK = 1 << 16
+PACKED_CODES = [
+    bytes(
+        b >> shift & 3
+        for shift in (6, 4, 2, 0)
+    )
+    for b in range(256)
+]
+CODE_BASES = bytes.maketrans(b'\0\1\2\3', BASES.encode())
+
+
+def keys_are_binary(keys: list) -> bool:
+    kinds = {isinstance(key, bytes) for key in keys}
+
+    if len(kinds) > 1:
+        raise TypeError('Keys should be either all str or all bytes')
+
+    return True in kinds
+
+
+def base_codes(text) -> bytes:
+    """
+    Code of every character of a str or bytes-like text, one byte per
+    character: the index of the character in BASES, or UNKNOWN_BASE.
+    """
+    if isinstance(text, str):
+        text = text.encode('ascii', 'replace')
+    elif not isinstance(text, (bytes, bytearray)):
+        text = bytes(text)
+
+    return text.translate(BASE_CODES)
+
+
+def base_runs(text):
+    """
+    Yield (position, codes, reset) for every run of bases of text, where
+    codes are the base_codes of the run and reset tells that an unknown
+    character comes before it. Text, or a PackedStrand, is translated
+    (unpacked) BASE_BLOCK characters at a time, so the codes take no
+    more memory than one block.
+    """
+    unknown = bytes([UNKNOWN_BASE])
+    packed = isinstance(text, PackedStrand)
+
+    for position in range(0, len(text), BASE_BLOCK):
+        if packed:
+            codes = text.codes(position, position + BASE_BLOCK)
+        else:
+            codes = base_codes(text[position:position + BASE_BLOCK])
+
+        runs = [codes]
+
+        if UNKNOWN_BASE in codes:
+            runs = codes.split(unknown)
+
+        for k, run in enumerate(runs):
+            yield position, run, k > 0
+            position += len(run) + 1
+
+
+def pack_bases(text) -> bytes:
+    """
+    Pack a strand made of BASES into 2 bits per base, four bases per
+    byte with the first one in the high bits. The last byte is padded,
+    so unpack_bases needs the length of the strand.
+    """
+    codes = base_codes(text)
+
+    if UNKNOWN_BASE in codes:
+        raise ValueError(f'Only the bases {BASES} can be packed')
+
+    codes += bytes(-len(codes) % 4)
+    return bytes(
+        a << 6 | b << 4 | c << 2 | d
+        for a, b, c, d in zip(
+            codes[0::4],
+            codes[1::4],
+            codes[2::4],
+            codes[3::4]
+        )
+    )
+
+
+def unpack_bases(packed: bytes, length: int) -> str:
+    return PackedStrand(packed, length)[:]
+
+
+class PackedStrand:
+    """
+    Strand packed by pack_bases, with its length, that the dna backend
+    scans as a text: base_runs unpacks it to base codes one BASE_BLOCK
+    at a time, so a long strand stays in 2 bits per base. Indexing and
+    iterating give its bases, for the scans of the other backends.
+    """
+
+    def __init__(self, packed: bytes, length: int):
+        if not 4 * len(packed) - 3 <= length <= 4 * len(packed):
+            raise ValueError(f'{len(packed)} bytes hold no {length} bases')
+
+        self.packed = packed
+        self.length = length
+
+    @classmethod
+    def pack(cls, text):
+        return cls(pack_bases(text), len(text))
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(self.length)
+
+            if step != 1:
+                raise ValueError('Only contiguous slices are supported')
+
+            return self.codes(start, stop).translate(CODE_BASES).decode()
+        elif not -self.length <= i < self.length:
+            raise IndexError('PackedStrand index out of range')
+
+        i %= self.length
+        return BASES[self.packed[i >> 2] >> (6 - 2 * (i & 3)) & 3]
+
+    def __iter__(self):
+        for position in range(0, self.length, BASE_BLOCK):
+            yield from self[position:position + BASE_BLOCK]
+
+    def codes(self, start: int, stop: int) -> bytes:
+        """
+        Codes of the bases from start to stop, one byte per base.
+        """
+        stop = min(stop, self.length)
+
+        if start >= stop:
+            return b''
+
+        first = start >> 2
+        codes = b''.join(
+            map(
+                PACKED_CODES.__getitem__,
+                self.packed[first:(stop + 3) >> 2]
+            )
+        )
+        return codes[start - 4*first:stop - 4*first]
+
+
+def digest_keys(keys, **options) -> str:
+    """
+    Canonical digest of a set of keys, of their payloads when keys is a
+    dict, and of build options: the same keys in any order give the same
+    digest. The sorted keys go through one blake2b pass, so this costs
+    far less than building, or the recursive Node.__hash__.
+    """
+    if isinstance(keys, dict):
+        items = sorted(
+            keys.items(),
+            key=lambda item: item[0]
+        )
+        keys = [key for key, _ in items]
+        payloads = [payload for _, payload in items]
+    else:
+        keys = sorted(
+            set(keys)
+        )
+        payloads = None
+
+    binary = keys_are_binary(keys)
+    digest = blake2b(digest_size=16)
+    digest.update(
+        repr(
+            (
+                binary,
+                sorted(
+                    options.items()
+                )
+            )
+        ).encode()
+    )
+    digest.update(
+        array('q', map(len, keys)).tobytes()
+    )
+
+    if binary:
+        digest.update(
+            b''.join(keys)
+        )
+    else:
+        digest.update(
+            ''.join(keys).encode('utf-8', 'surrogatepass')
+        )
+
+    digest.update(
+        repr(payloads).encode()
+    )
+    return digest.hexdigest()
+
+
+# Automaton loaded once per process by load_worker_automaton, used by the
+# process pools of AhoCorasick.find_in_parallel and find_in_many.
+worker_automaton = None
+
+
+def load_worker_automaton(path: str):
+    global worker_automaton
+    worker_automaton = AhoCorasick.load(path)
+
+
+def find_in_segment(task: tuple) -> dict:
+    """
+    Find keys in text and keep only those starting before limit, shifted
+    by offset. Keys starting after limit belong to the next segment.
+    """
+    text, offset, limit = task
+    return {
+        key: [start + offset for start in starts if start < limit]
+        for key, starts in worker_automaton.find_in(text).items()
+    }
+
+
+def find_in_shard(task: tuple) -> dict:
+    path, text = task
+    return dict(
+        AhoCorasick.load(path).find_in(text)
+    )
+
+
+def find_in_documents(
+    documents: list,
+    aho_corasick=None
+) -> list:
+    aho_corasick = aho_corasick or worker_automaton
+    return [
+        aho_corasick.find_in(document)
+        for document in documents
+    ]
 
 
 class Node:
@@ -46,6 +355,18 @@ class Node:
         # for data type set, dict, list, and tuple.
         self.childs = set()
 
+        # Transition table keyed by the last character of
+        # each child key, so find_in can move to the next
+        # node with one lookup instead of scanning childs.
+        self.goto = {}
+
+        # Fully resolved transitions, only filled in DFA mode.
+        self.delta = None
+
+    def add_child(self, child):
+        self.childs.add(child)
+        self.goto[child.key[-1]] = child
+
     # Recommended way to implement __eq__ and __hash__
     # Source:
     # https://stackoverflow.com/questions/45164691/recommended-way-to-implement-eq-and-hash
@@ -132,252 +453,3025 @@ class Node:
         )
 
 
-class AhoCorasick:
+class KeyTable:
+    """
+    Read-only sequence of keys stored as one UTF-8 blob plus offsets,
+    as loaded by CompactAutomaton.load. Keys are decoded on first use,
+    so a memory-mapped automaton does not decode its whole dictionary.
+    Binary keys are returned as bytes.
     """
-    Class AhoCorasick Version 2.6.1
 
-    the Aho–Corasick algorithm is a string-searching algorithm invented by
-    Alfred V. Aho and Margaret J. Corasick.
+    def __init__(
+        self,
+        blob: memoryview,
+        offsets: memoryview,
+        binary: bool = False
+    ):
+        self.blob = blob
+        self.offsets = offsets
+        self.binary = binary
+        self.decoded = {}
 
-    Implemented by Pipin Fitriadi (pipinfitriadi@gmail.com) at May 19th, 2019
-    and updated at May 28th, 2019.
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
 
-    Source:
-    - https://en.wikipedia.org/wiki/Aho%E2%80%93Corasick_algorithm
-    - https://www.youtube.com/watch?v=qPyhPXPl3T4
+    def __getitem__(self, p: int) -> str:
+        key = self.decoded.get(p)
+
+        if key is None:
+            key = self.blob[self.offsets[p]:self.offsets[p + 1]]
+
+            if self.binary:
+                key = bytes(key)
+            else:
+                key = str(key, 'utf-8', 'surrogatepass')
+
+            self.decoded[p] = key
+
+        return key
+
+    def __iter__(self):
+        for p in range(len(self)):
+            yield self[p]
+
+    def __sizeof__(self) -> int:
+        return self.blob.nbytes + self.offsets.nbytes
+
+
+class CompactAutomaton:
+    """
+    Array-backed Aho–Corasick automaton.
+
+    States are plain integers (0 is the root) and every table is a flat
+    array, so there is no Python object per state and every key is stored
+    only once in self.keys:
+    - edge_offset[s]:edge_offset[s+1] is the slice of edge_symbol and
+      edge_target holding the goto transitions of state s, sorted by
+      symbol code.
+    - fail[s] is the failure (suffix) state of s.
+    - output[s] is the nearest failure state that ends a key, or -1.
+    - pattern[s] is the index in self.keys of the key ending at s, or -1.
+    - delta is the fully resolved states * alphabet table in DFA mode.
+
+    Keys are either all str, or all bytes in which case the symbols are
+    byte values and texts are scanned byte by byte.
     """
 
+    typecode = 'i'
+
     def __init__(self, keys: list):
-        self.tree = self.build_tree(keys)
+        self.keys = sorted(
+            {key for key in keys if key}
+        )
+        self.binary = keys_are_binary(self.keys)
+        self.alphabet = {
+            t: c
+            for c, t in enumerate(
+                sorted(
+                    {t for key in self.keys for t in key}
+                )
+            )
+        }
+        self.delta = None
+        self.depth = None
+        self.build()
 
-    def build_tree(self, keys: list) -> Node:
-        keys = sorted(keys)
-        root = {}
-        root[''] = Node()
+    def build(self):
+        typecode = self.typecode
+        alphabet = self.alphabet
+        pattern = array(typecode, [-1])
+        edge_parent = array(typecode)
+        edge_symbol = array(typecode)
+        edge_target = array(typecode)
 
-        for key in keys:
-            for k in range(
-                len(key)
-            ):
-                current_key = key[:k+1]
+        # Keys are sorted, so the trie can be laid out depth-first by
+        # keeping only the path of the previous key on a stack.
+        path = [0]
+        previous = ''
 
-                if current_key not in root:
-                    root[current_key] = Node(
-                        current_key,
-                        current_key in keys
-                    )
+        for p, key in enumerate(self.keys):
+            common = 0
 
-                parent_key = current_key[:-1]
+            for a, b in zip(previous, key):
+                if a != b:
+                    break
 
-                if parent_key not in root:
-                    root[parent_key] = Node(
-                        parent_key,
-                        parent_key in keys
-                    )
+                common += 1
 
-                root[parent_key].childs.add(
-                    root[current_key]
-                )
+            del path[common+1:]
 
-        for key in root:
-            for k in range(
-                len(key)
-            ):
-                suffix = key[k+1:]
+            for t in key[common:]:
+                state = len(pattern)
+                pattern.append(-1)
+                edge_parent.append(path[-1])
+                edge_symbol.append(alphabet[t])
+                edge_target.append(state)
+                path.append(state)
 
-                if suffix in root:
-                    root[key].suffix = root[suffix]
+            pattern[path[-1]] = p
+            previous = key
 
-                    for s in range(
-                        len(suffix)
-                    ):
-                        key_suffix = suffix[s:]
+        # Group edges by parent state (counting sort). Children were
+        # created in increasing symbol order, which the sort keeps.
+        states = len(pattern)
+        offset = array(typecode, [0]) * (states + 1)
 
-                        if key_suffix in keys:
-                            root[key].key_suffix = root[key_suffix]
-                            break
+        for parent in edge_parent:
+            offset[parent + 1] += 1
 
-                    break
+        for s in range(states):
+            offset[s + 1] += offset[s]
 
-        return root['']
+        fill = offset[:-1]
+        self.edge_symbol = array(typecode, [0]) * len(edge_parent)
+        self.edge_target = array(typecode, [0]) * len(edge_parent)
 
-    def find_in(self, text: str) -> dict:
-        output = defaultdict(list)
-        node = self.tree
+        for e, parent in enumerate(edge_parent):
+            j = fill[parent]
+            self.edge_symbol[j] = edge_symbol[e]
+            self.edge_target[j] = edge_target[e]
+            fill[parent] = j + 1
 
-        for i, t in enumerate(text):
-            while node:
-                for child in node.childs:
-                    key = child.key
+        self.edge_offset = offset
+        self.pattern = pattern
+        self.fail = array(typecode, [0]) * states
+        self.output = array(typecode, [-1]) * states
+        self.build_links()
 
-                    if key[-1:] == t:
-                        if child.in_keys:
-                            output[key].append(
-                                i - len(key) + 1
-                            )
+    def goto(self, state: int, c: int) -> int:
+        lo = self.edge_offset[state]
+        hi = self.edge_offset[state + 1]
+        j = bisect_left(self.edge_symbol, c, lo, hi)
 
-                        key_suffix = child.key_suffix
+        if j < hi and self.edge_symbol[j] == c:
+            return self.edge_target[j]
 
-                        if key_suffix:
-                            while key_suffix:
-                                key = key_suffix.key
-                                output[key].append(
-                                    i - len(key) + 1
-                                )
-                                key_suffix = key_suffix.key_suffix
+        return -1
 
-                        node = child
-                        is_found = True
-                        break
-                else:
-                    node = node.suffix
-                    is_found = False
+    def bfs_order(self) -> array:
+        order = array(self.typecode, [0])
+        offset = self.edge_offset
+        k = 0
 
-                if is_found:
-                    break
-            else:
-                node = self.tree
+        while k < len(order):
+            s = order[k]
+            order.extend(
+                self.edge_target[offset[s]:offset[s + 1]]
+            )
+            k += 1
 
-        return output
+        return order
 
-    def are_keys_found_equal_to(
-        self,
-        text: str,
-        other_keys_found: dict
-    ) -> bool:
-        k1 = self.find_in(text)
-        k2 = other_keys_found
-        k1_keys = k1.keys()
+    def build_links(self):
+        fail = self.fail
+        output = self.output
+        pattern = self.pattern
+        offset = self.edge_offset
 
-        if len(k1) != len(k2):
-            return False
-        elif k1_keys != k2.keys():
-            return False
+        for s in self.bfs_order():
+            for j in range(offset[s], offset[s + 1]):
+                c = self.edge_symbol[j]
+                child = self.edge_target[j]
+                f = 0
 
-        for key in k1_keys:
-            get_k1_key = k1[key]
-            get_k2_key = k2[key]
-            len_k1_key = len(get_k1_key)
+                if s:
+                    f = fail[s]
 
-            if len_k1_key != len(k2[key]):
-                return False
+                    while True:
+                        nxt = self.goto(f, c)
 
-            for k in range(len_k1_key):
-                if get_k1_key[k] != get_k2_key[k]:
-                    return False
+                        if nxt >= 0:
+                            f = nxt
+                            break
+                        elif not f:
+                            break
 
-        return True
+                        f = fail[f]
 
+                fail[child] = f
+                output[child] = f if pattern[f] >= 0 else output[f]
 
-class Test(TestCase):
-    def test_AhoCorasick_tree_1(self):
-        self.assertEqual(
-            AhoCorasick(
-                ['']
-            ).tree == Node(),
-            True
-        )
+    def states(self) -> int:
+        return len(self.fail)
 
-    def test_AhoCorasick_tree_2(self):
-        tree = Node()
-        a = Node('a', True, tree)
-        ab = Node('ab', True, tree)
+    def depths(self) -> array:
+        """
+        Length of the path from the root to every state, computed on
+        first use as only leftmost match kinds need it.
+        """
+        if self.depth is None:
+            depth = array(self.typecode, [0]) * self.states()
+            offset = self.edge_offset
 
-        tree.childs.add(a)
-        a.childs.add(ab)
+            for s in self.bfs_order():
+                for j in range(offset[s], offset[s + 1]):
+                    depth[self.edge_target[j]] = depth[s] + 1
 
-        self.assertEqual(
-            AhoCorasick(
-                ['a', 'ab']
-            ).tree == tree,
-            True
+            self.depth = depth
+
+        return self.depth
+
+    def dfa_memory_estimate(self) -> int:
+        return (
+            self.states()
+            * len(self.alphabet)
+            * array(self.typecode).itemsize
         )
 
-    def test_AhoCorasick_tree_3(self):
-        tree = Node()
-        a = Node('a', True, tree)
-        b = Node('b', False, tree)
-        c = Node('c', True, tree)
-        ab = Node('ab', True, b)
-        ba = Node('ba', False, a, a)
-        bc = Node('bc', True, c, c)
-        ca = Node('ca', False, a, a)
-        bab = Node('bab', True, ab, ab)
-        bca = Node('bca', True, ca, a)
-        caa = Node('caa', True, a, a)
+    def build_dfa(self):
+        sigma = len(self.alphabet)
+        offset = self.edge_offset
+        delta = array(self.typecode, [0]) * (self.states() * sigma)
 
-        tree.childs = {a, b, c}
-        a.childs.add(ab)
-        b.childs = {ba, bc}
-        c.childs.add(ca)
-        ba.childs.add(bab)
-        bc.childs.add(bca)
-        ca.childs.add(caa)
+        for s in self.bfs_order():
+            if s:
+                f = self.fail[s] * sigma
+                delta[s*sigma:(s + 1)*sigma] = delta[f:f + sigma]
 
-        self.assertEqual(
-            AhoCorasick(
-                ['a', 'ab', 'bab', 'bc', 'bca', 'c', 'caa']
-            ).tree == tree,
-            True
-        )
+            for j in range(offset[s], offset[s + 1]):
+                delta[s*sigma + self.edge_symbol[j]] = self.edge_target[j]
 
-    def test_AhoCorasick_tree_4(self):
-        tree = Node()
-        a = Node('a', False, tree)
-        b = Node('b', True, tree)
-        c = Node('c', True, tree)
-        d = Node('d', True, tree)
-        aa = Node('aa', True, a)
+        self.delta = delta
 
-        tree.childs = {a, b, c, d}
-        a.childs.add(aa)
+    def tables(self) -> list:
+        tables = [
+            self.edge_offset,
+            self.edge_symbol,
+            self.edge_target,
+            self.fail,
+            self.output,
+            self.pattern
+        ]
 
-        self.assertEqual(
-            AhoCorasick(
-                ['b', 'c', 'aa', 'd', 'b']
-            ).tree == tree,
-            True
-        )
+        if self.delta is not None:
+            tables.append(self.delta)
 
-    def test_AhoCorasick_tree_5(self):
-        tree = Node()
-        a = Node('a', True, tree)
-        b = Node('b', True, tree)
-        c = Node('c', True, tree)
-        d = Node('d', True, tree)
-        aa = Node('aa', True, a, a)
+        return tables
 
-        tree.childs = {a, b, c, d}
-        a.childs.add(aa)
+    def nbytes(self) -> int:
+        if isinstance(self.keys, KeyTable):
+            keys = getsizeof(self.keys)
+        else:
+            keys = sum(
+                getsizeof(key)
+                for key in self.keys
+            )
 
-        self.assertEqual(
-            AhoCorasick(
-                ['a', 'b', 'c', 'aa', 'd']
-            ).tree == tree,
-            True
+        return (
+            sum(
+                table.itemsize * len(table)
+                for table in self.tables()
+            )
+            + keys
+            + getsizeof(self.alphabet)
         )
 
-    def test_AhoCorasick_tree_6(self):
-        tree = Node()
-        a = Node('a', False, tree)
-        c = Node('c', True, tree)
-        d = Node('d', True, tree)
-        aa = Node('aa', True, a)
+    def bytes_per_state(self) -> float:
+        return self.nbytes() / self.states()
 
-        tree.childs = {a, c, d}
-        a.childs.add(aa)
+    def scan(self, text: str, state: int = 0):
+        """
+        Yield (i, state) for every position i of text whose state ends
+        at least one key, and return the state after the last position.
+        """
+        get = self.alphabet.get
+        pattern = self.pattern
+        output = self.output
 
-        self.assertEqual(
-            AhoCorasick(
-                ['c', 'aa', 'd']
-            ).tree == tree,
-            True
-        )
+        if self.delta is not None:
+            delta = self.delta
+            sigma = len(self.alphabet)
 
-    def test_AhoCorasick_keys_found_1(self):
-        self.assertEqual(
-            AhoCorasick(
-                ['a', 'ab', 'bab', 'bc', 'bca', 'c', 'caa']
+            for i, t in enumerate(text):
+                c = get(t)
+                state = 0 if c is None else delta[state*sigma + c]
+
+                if pattern[state] >= 0 or output[state] >= 0:
+                    yield i, state
+
+            return state
+
+        offset = self.edge_offset
+        symbol = self.edge_symbol
+        target = self.edge_target
+        fail = self.fail
+
+        for i, t in enumerate(text):
+            c = get(t)
+
+            if c is None:
+                state = 0
+                continue
+
+            while True:
+                lo = offset[state]
+                hi = offset[state + 1]
+                j = bisect_left(symbol, c, lo, hi)
+
+                if j < hi and symbol[j] == c:
+                    state = target[j]
+                    break
+                elif not state:
+                    break
+
+                state = fail[state]
+
+            if pattern[state] >= 0 or output[state] >= 0:
+                yield i, state
+
+        return state
+
+    def outputs(self, state: int):
+        keys = self.keys
+        p = self.pattern[state]
+
+        if p >= 0:
+            yield keys[p]
+
+        state = self.output[state]
+
+        while state >= 0:
+            yield keys[self.pattern[state]]
+            state = self.output[state]
+
+    def iter_leftmost(self, text: str, longest: bool, rank):
+        """
+        Leftmost non-overlapping matches, see AhoCorasick.iter_leftmost.
+        """
+        get = self.alphabet.get
+        keys = self.keys
+        pattern = self.pattern
+        output = self.output
+        depth = self.depths()
+        delta = self.delta
+        sigma = len(self.alphabet)
+        offset = self.edge_offset
+        symbol = self.edge_symbol
+        target = self.edge_target
+        fail = self.fail
+        state = 0
+        match = None
+        n = len(text)
+        i = 0
+
+        while True:
+            if i < n:
+                c = get(text[i])
+
+                if c is None:
+                    state = 0
+                elif delta is not None:
+                    state = delta[state*sigma + c]
+                else:
+                    while True:
+                        lo = offset[state]
+                        hi = offset[state + 1]
+                        j = bisect_left(symbol, c, lo, hi)
+
+                        if j < hi and symbol[j] == c:
+                            state = target[j]
+                            break
+                        elif not state:
+                            break
+
+                        state = fail[state]
+            elif match is None:
+                return
+
+            if match is not None and (
+                i == n or i - depth[state] >= match[0]
+            ):
+                yield match
+                i = match[1]
+                state = 0
+                match = None
+                continue
+
+            found = state if pattern[state] >= 0 else output[state]
+
+            if found >= 0:
+                key = keys[pattern[found]]
+                start = i - len(key) + 1
+
+                if match is None or start < match[0] or (
+                    start == match[0]
+                    and (longest or rank(key) < rank(match[2]))
+                ):
+                    match = start, i + 1, key
+
+            i += 1
+
+    def save(self, path: str):
+        symbols = sorted(self.alphabet, key=self.alphabet.get)
+        key_offsets = array('q', [0])
+        blob = bytearray()
+
+        if self.binary:
+            alphabet = bytes(symbols)
+        else:
+            alphabet = ''.join(symbols).encode('utf-8', 'surrogatepass')
+
+        for key in self.keys:
+            if not self.binary:
+                key = key.encode('utf-8', 'surrogatepass')
+
+            blob += key
+            key_offsets.append(len(blob))
+
+        tables = self.tables()
+        sections = [alphabet, key_offsets.tobytes(), blob] + [
+            table.tobytes()
+            for table in tables
+        ]
+
+        with open(path, 'wb') as content:
+            content.write(
+                FORMAT_HEADER.pack(
+                    FORMAT_MAGIC,
+                    FORMAT_VERSION,
+                    byteorder == 'big',
+                    tables[0].itemsize,
+                    (
+                        (FORMAT_DFA if self.delta is not None else 0)
+                        | (FORMAT_BINARY if self.binary else 0)
+                    ),
+                    self.states(),
+                    len(self.edge_symbol),
+                    len(self.alphabet),
+                    len(self.keys),
+                    len(alphabet),
+                    len(blob)
+                )
+            )
+
+            for section in sections:
+                content.write(section)
+                content.write(
+                    bytes(-len(section) % 8)
+                )
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True):
+        with open(path, 'rb') as content:
+            # An empty file cannot be mapped, it is reported as truncated.
+            if mmap and fstat(content.fileno()).st_size:
+                buffer = memory_map(
+                    content.fileno(),
+                    0,
+                    access=ACCESS_READ
+                )
+            else:
+                buffer = content.read()
+
+        view = memoryview(buffer)
+
+        if len(view) < FORMAT_HEADER.size:
+            raise ValueError(f'{path} is truncated')
+
+        (
+            magic,
+            version,
+            big_endian,
+            itemsize,
+            flags,
+            states,
+            edges,
+            sigma,
+            keys,
+            alphabet_size,
+            blob_size
+        ) = FORMAT_HEADER.unpack_from(view)
+
+        if magic != FORMAT_MAGIC:
+            raise ValueError(f'{path} is not a saved AhoCorasick')
+        elif not 1 <= version <= FORMAT_VERSION:
+            raise ValueError(
+                f'{path} has format version {version}, '
+                f'expected at most {FORMAT_VERSION}'
+            )
+        elif big_endian != (byteorder == 'big'):
+            raise ValueError(f'{path} was saved with another byte order')
+        elif itemsize != array(cls.typecode).itemsize:
+            raise ValueError(f'{path} was saved with another item size')
+
+        sizes = [
+            alphabet_size,
+            (keys + 1) * 8,
+            blob_size,
+            (states + 1) * itemsize,
+            edges * itemsize,
+            edges * itemsize,
+            states * itemsize,
+            states * itemsize,
+            states * itemsize
+        ]
+
+        if flags & FORMAT_DFA:
+            sizes.append(states * sigma * itemsize)
+
+        sections = []
+        position = FORMAT_HEADER.size
+
+        for size in sizes:
+            if position + size > len(view):
+                raise ValueError(f'{path} is truncated')
+
+            sections.append(
+                view[position:position + size]
+            )
+            position += size + (-size % 8)
+
+        self = cls.__new__(cls)
+        self.buffer = buffer
+        # Version 1 files have no FORMAT_BINARY flag and are always str.
+        self.binary = bool(flags & FORMAT_BINARY)
+        symbols = bytes(sections[0])
+
+        if not self.binary:
+            symbols = str(symbols, 'utf-8', 'surrogatepass')
+
+        self.alphabet = {
+            t: c
+            for c, t in enumerate(symbols)
+        }
+        self.keys = KeyTable(
+            sections[2],
+            sections[1].cast('q'),
+            self.binary
+        )
+        (
+            self.edge_offset,
+            self.edge_symbol,
+            self.edge_target,
+            self.fail,
+            self.output,
+            self.pattern
+        ) = [
+            section.cast(cls.typecode)
+            for section in sections[3:9]
+        ]
+        self.delta = None
+        self.depth = None
+
+        if flags & FORMAT_DFA:
+            self.delta = sections[9].cast(cls.typecode)
+
+        return self
+
+    def find_in(self, text: str) -> dict:
+        output = defaultdict(list)
+
+        for i, state in self.scan(text):
+            for key in self.outputs(state):
+                output[key].append(
+                    i - len(key) + 1
+                )
+
+        return output
+
+
+class NucleotideAutomaton(CompactAutomaton):
+    """
+    CompactAutomaton over keys made of the BASES only, that scans texts
+    through a 4-wide transition table indexed by base code:
+
+    - bases[4*s + b] is 4 times the state reached from s by the base
+      coded b, so every step is a single lookup bases[state + b].
+    - end[4*s] is 1 when s ends at least one key.
+
+    Texts are translated to base codes with bytes.translate, or a
+    PackedStrand unpacked to them, and split on unknown characters;
+    every run after an unknown character is scanned from the root,
+    which is the explicit reset.
+    """
+
+    def __init__(self, keys: list):
+        super().__init__(keys)
+        symbols = [
+            ord(t) if self.binary else t
+            for t in BASES
+        ]
+
+        if not set(self.alphabet) <= set(symbols):
+            raise ValueError(f'Keys should be made of the bases {BASES}')
+
+        base = {
+            self.alphabet[t]: b
+            for b, t in enumerate(symbols)
+            if t in self.alphabet
+        }
+        offset = self.edge_offset
+        bases = array(self.typecode, [0]) * (4 * self.states())
+
+        for s in self.bfs_order():
+            if s:
+                f = 4 * self.fail[s]
+                bases[4*s:4*s + 4] = bases[f:f + 4]
+
+            for j in range(offset[s], offset[s + 1]):
+                bases[4*s + base[self.edge_symbol[j]]] = (
+                    4 * self.edge_target[j]
+                )
+
+        self.bases = bases
+        self.end = bytearray(4 * self.states())
+
+        for s in range(self.states()):
+            if self.pattern[s] >= 0 or self.output[s] >= 0:
+                self.end[4 * s] = 1
+
+    def nbytes(self) -> int:
+        return (
+            super().nbytes()
+            + self.bases.itemsize * len(self.bases)
+            + len(self.end)
+        )
+
+    def scan(self, text: str, state: int = 0):
+        bases = self.bases
+        end = self.end
+        state *= 4
+
+        for position, run, reset in base_runs(text):
+            if reset:
+                state = 0
+
+            for i, c in enumerate(run, position):
+                state = bases[state + c]
+
+                if end[state]:
+                    yield i, state >> 2
+
+        return state >> 2
+
+    def find_in(self, text: str) -> dict:
+        output = defaultdict(list)
+        bases = self.bases
+        end = self.end
+        # Position lists and key lengths of the keys ending at every
+        # state reached, resolved on its first hit.
+        hits = {}
+        state = 0
+
+        for position, run, reset in base_runs(text):
+            if reset:
+                state = 0
+
+            for i, c in enumerate(run, position):
+                state = bases[state + c]
+
+                if end[state]:
+                    found = hits.get(state)
+
+                    if found is None:
+                        found = hits[state] = [
+                            (output[key], len(key) - 1)
+                            for key in self.outputs(state >> 2)
+                        ]
+
+                    for starts, length in found:
+                        starts.append(i - length)
+
+        return output
+
+
+class ScanStats:
+    """
+    Counters filled while an AhoCorasick with stats enabled scans:
+    - characters: symbols read.
+    - goto_hits: goto transitions taken (DFA table lookups in DFA mode).
+    - failure_hops: suffix links followed after a goto miss.
+    - output_links: key_suffix (output) links followed to report keys.
+    - matches: keys reported.
+    build_seconds holds the build phase timings of the automaton.
+    """
+
+    counters = (
+        'characters',
+        'goto_hits',
+        'failure_hops',
+        'output_links',
+        'matches'
+    )
+
+    def __init__(self, build_seconds: dict = None):
+        self.build_seconds = build_seconds or {}
+        self.reset()
+
+    def reset(self):
+        for counter in self.counters:
+            setattr(self, counter, 0)
+
+    def as_dict(self) -> dict:
+        stats = {
+            counter: getattr(self, counter)
+            for counter in self.counters
+        }
+        stats.update(
+            {
+                f'build_seconds.{phase}': seconds
+                for phase, seconds in self.build_seconds.items()
+            }
+        )
+        return stats
+
+
+class KeySnapshot:
+    """
+    Keys of an AhoCorasick as one value: its Node tree or array
+    automaton, with the payloads and leftmost-first priority of the
+    keys. update_keys swaps in a new one, so a scan that took the
+    old one never mixes the keys of both. readers counts the scans
+    still reading it, see AhoCorasick.reading.
+    """
+
+    def __init__(
+        self,
+        tree: Node,
+        automaton: CompactAutomaton,
+        payloads: dict,
+        priority: dict
+    ):
+        self.tree = tree
+        self.automaton = automaton
+        self.payloads = payloads
+        self.priority = priority
+        self.readers = 0
+
+
+class AhoCorasick:
+    """
+    Class AhoCorasick Version 2.6.1
+
+    the Aho–Corasick algorithm is a string-searching algorithm invented by
+    Alfred V. Aho and Margaret J. Corasick.
+
+    Implemented by Pipin Fitriadi (pipinfitriadi@gmail.com) at May 19th, 2019
+    and updated at May 28th, 2019.
+
+    Source:
+    - https://en.wikipedia.org/wiki/Aho%E2%80%93Corasick_algorithm
+    - https://www.youtube.com/watch?v=qPyhPXPl3T4
+    """
+
+    def __init__(
+        self,
+        keys: list,
+        mode: str = 'lazy',
+        max_dfa_alphabet: int = DFA_MAX_ALPHABET,
+        backend: str = 'node',
+        stats: bool = False
+    ):
+        if mode not in ('lazy', 'dfa'):
+            raise ValueError(f'Unknown mode: {mode!r}')
+        elif backend not in ('node', 'array', 'dna'):
+            raise ValueError(f'Unknown backend: {backend!r}')
+
+        # Keys given as a dict map every key to its payload, e.g. the
+        # weight added by score_in for every occurrence of the key.
+        payloads = dict(keys) if isinstance(keys, dict) else {}
+        keys = list(keys)
+        self.binary = keys_are_binary(keys)
+        self.build_seconds = {}
+        # Rank of every key in the order given, for leftmost-first.
+        priority = {
+            key: p
+            for p, key in enumerate(
+                dict.fromkeys(keys)
+            )
+        }
+
+        if backend == 'node':
+            self.snapshot = KeySnapshot(
+                self.build_tree(keys),
+                None,
+                payloads,
+                priority
+            )
+        else:
+            t0 = perf_counter()
+
+            if backend == 'dna':
+                automaton = NucleotideAutomaton(keys)
+            else:
+                automaton = CompactAutomaton(keys)
+
+            self.snapshot = KeySnapshot(None, automaton, payloads, priority)
+            self.build_seconds['automaton'] = perf_counter() - t0
+
+        self.backend = backend
+        self.mode = mode
+
+        if mode == 'dfa':
+            if len(self.alphabet()) > max_dfa_alphabet:
+                self.mode = 'lazy'
+            else:
+                t0 = perf_counter()
+                self.build_dfa()
+                self.build_seconds['dfa'] = perf_counter() - t0
+
+        self.stats = ScanStats(self.build_seconds) if stats else None
+
+        # Reverse failure links (id of a node to the nodes whose suffix it
+        # is), kept between in-place updates of the Node tree.
+        self.fail_childs = None
+        self.lock = Lock()
+
+    @property
+    def tree(self) -> Node:
+        return self.snapshot.tree
+
+    @property
+    def automaton(self) -> CompactAutomaton:
+        return self.snapshot.automaton
+
+    @property
+    def payloads(self) -> dict:
+        return self.snapshot.payloads
+
+    @property
+    def priority(self) -> dict:
+        return self.snapshot.priority
+
+    def reading(self, snapshot: KeySnapshot = None) -> KeySnapshot:
+        """
+        Snapshot (the current one when None), counted as read until
+        given to release. An update waits for no reader: it copies a
+        tree being read instead of changing it in place.
+        """
+        with self.lock:
+            snapshot = snapshot or self.snapshot
+            snapshot.readers += 1
+
+        return snapshot
+
+    def release(self, snapshot: KeySnapshot):
+        with self.lock:
+            snapshot.readers -= 1
+
+    def iter_nodes(self, root: Node = None):
+        queue = deque([root or self.tree])
+
+        while queue:
+            node = queue.popleft()
+            yield node
+            queue.extend(
+                node.goto.values()
+            )
+
+    def alphabet(self) -> set:
+        if self.automaton is not None:
+            return set(self.automaton.alphabet)
+
+        return {
+            t
+            for node in self.iter_nodes()
+            for t in node.goto
+        }
+
+    def states(self) -> int:
+        if self.automaton is not None:
+            return self.automaton.states()
+
+        return sum(1 for _ in self.iter_nodes())
+
+    def nbytes(self) -> int:
+        """
+        Approximate bytes taken by the automaton: its tables with the
+        array backend, every Node with its key, dicts and set otherwise.
+        """
+        if self.automaton is not None:
+            return self.automaton.nbytes()
+
+        return sum(
+            getsizeof(node)
+            + getsizeof(node.__dict__)
+            + getsizeof(node.key)
+            + getsizeof(node.goto)
+            + getsizeof(node.childs)
+            + (0 if node.delta is None else getsizeof(node.delta))
+            for node in self.iter_nodes()
+        )
+
+    def dfa_memory_estimate(self) -> int:
+        """
+        Approximate bytes taken by the DFA tables, that is one
+        dict per state holding one entry per alphabet character.
+        With the array backend it is one flat states * alphabet table.
+        """
+        if self.automaton is not None:
+            return self.automaton.dfa_memory_estimate()
+
+        states = sum(1 for _ in self.iter_nodes())
+        table = dict.fromkeys(
+            range(
+                len(self.alphabet())
+            )
+        )
+        return states * getsizeof(table)
+
+    def build_dfa(self):
+        if self.automaton is not None:
+            self.automaton.build_dfa()
+            return
+
+        root = self.tree
+        alphabet = self.alphabet()
+
+        for node in self.iter_nodes():
+            if node is root:
+                node.delta = {
+                    t: node.goto.get(t, root)
+                    for t in alphabet
+                }
+            else:
+                # Breadth-first order guarantees the suffix
+                # node is shallower, so its delta is complete.
+                delta = dict(node.suffix.delta)
+                delta.update(node.goto)
+                node.delta = delta
+
+    def build_tree(self, keys: list) -> Node:
+        t0 = perf_counter()
+        keys = set(keys)
+        root = Node()
+
+        for key in keys:
+            node = root
+
+            for k, t in enumerate(key):
+                child = node.goto.get(t)
+
+                if child is None:
+                    current_key = key[:k+1]
+                    child = Node(
+                        current_key,
+                        current_key in keys
+                    )
+                    node.add_child(child)
+
+                node = child
+
+        t1 = perf_counter()
+
+        # Breadth-first traversal, so the suffix of every node
+        # is already resolved before any of its children.
+        queue = deque()
+
+        for child in root.goto.values():
+            child.suffix = root
+            queue.append(child)
+
+        while queue:
+            node = queue.popleft()
+
+            for t, child in node.goto.items():
+                suffix = node.suffix
+
+                while suffix is not None and t not in suffix.goto:
+                    suffix = suffix.suffix
+
+                child.suffix = root if suffix is None else suffix.goto[t]
+                suffix = child.suffix
+                child.key_suffix = (
+                    suffix if suffix.in_keys else suffix.key_suffix
+                )
+                queue.append(child)
+
+        self.build_seconds['trie'] = t1 - t0
+        self.build_seconds['links'] = perf_counter() - t1
+        return root
+
+    def add_keys(self, keys: list, snapshot: bool = True):
+        self.update_keys(keys, [], snapshot)
+
+    def remove_keys(self, keys: list, snapshot: bool = True):
+        self.update_keys([], keys, snapshot)
+
+    def update_keys(
+        self,
+        added: list,
+        removed: list,
+        snapshot: bool = True
+    ):
+        """
+        Remove then add keys. Added keys given as a dict also update
+        the payloads.
+
+        With the node backend, trie paths are pruned or inserted, and
+        suffix, key_suffix (and DFA) links are recomputed only for nodes
+        having a changed node as suffix, in place. With snapshot, a tree
+        that scans are still reading (see reading), like a partly
+        consumed iter_matches, is copied whole first and the copy is
+        updated, so those scans go on with the old keys; without it the
+        tree is always updated in place, under the running scans. The
+        array and dna backends are rebuilt from all the keys, a full
+        build.
+
+        Keys are checked before anything changes, and the tree or
+        automaton is swapped with its payloads and priority as one
+        KeySnapshot. Scans starting during an update wait for it.
+        """
+        with self.lock:
+            self.snapshot = self.updated_snapshot(added, removed, snapshot)
+
+    def updated_snapshot(
+        self,
+        added: list,
+        removed: list,
+        snapshot: bool
+    ) -> KeySnapshot:
+        """
+        KeySnapshot with the keys changed by update_keys, which holds
+        the lock.
+        """
+        payloads = dict(self.payloads)
+        removed = list(removed)
+
+        for key in removed:
+            payloads.pop(key, None)
+
+        if isinstance(added, dict):
+            payloads.update(added)
+
+        added = [key for key in added if key]
+        removed = [key for key in removed if key]
+
+        if (added or removed) and (
+            keys_are_binary(added + removed) != self.binary
+        ):
+            raise TypeError('Keys should be of the same type as the others')
+        elif self.backend == 'dna':
+            bases = set(BASES.encode() if self.binary else BASES)
+
+            if not all(set(key) <= bases for key in added):
+                raise ValueError(f'Keys should be made of the bases {BASES}')
+
+        priority = self.priority
+
+        if priority is not None:
+            priority = dict(priority)
+
+            for key in removed:
+                priority.pop(key, None)
+
+            for key in added:
+                priority.setdefault(
+                    key,
+                    next(reversed(priority.values()), -1) + 1
+                )
+
+        if self.automaton is not None:
+            keys = set(self.automaton.keys)
+            keys.difference_update(removed)
+            keys.update(added)
+            automaton = type(self.automaton)(keys)
+
+            if self.mode == 'dfa':
+                automaton.build_dfa()
+
+            return KeySnapshot(None, automaton, payloads, priority)
+
+        if snapshot and self.snapshot.readers:
+            root, fail_childs = self.clone_tree()
+        else:
+            root = self.tree
+            fail_childs = (
+                self.fail_childs or self.index_fail_childs(root)
+            )
+
+        # Nodes whose suffix, in_keys or goto changed: the suffix links,
+        # outputs and DFA rows of their failure subtrees are recomputed.
+        changed_suffix = []
+        changed_in_keys = []
+        changed_goto = []
+        dropped = {}
+
+        for key in removed:
+            path = [root]
+
+            for t in key:
+                node = path[-1].goto.get(t)
+
+                if node is None:
+                    break
+
+                path.append(node)
+            else:
+                node = path[-1]
+
+                if not node.in_keys:
+                    continue
+
+                node.in_keys = False
+                changed_in_keys.append(node)
+
+                while len(path) > 1 and not (node.in_keys or node.goto):
+                    path.pop()
+                    parent = path[-1]
+                    del parent.goto[node.key[-1]]
+                    parent.childs = {
+                        child
+                        for child in parent.childs
+                        if child is not node
+                    }
+                    changed_goto.append(parent)
+                    dropped[id(node)] = node
+                    node = parent
+
+        for node in dropped.values():
+            for child in fail_childs.pop(id(node), []):
+                if id(child) in dropped:
+                    continue
+
+                # The next suffix still in the trie is the longest one.
+                suffix = node.suffix
+
+                while id(suffix) in dropped:
+                    suffix = suffix.suffix
+
+                child.suffix = suffix
+                fail_childs[id(suffix)].append(child)
+                changed_suffix.append(child)
+
+            if id(node.suffix) not in dropped:
+                self.unlink_fail_child(fail_childs, node)
+
+        created = []
+        parents = {}
+
+        for key in added:
+            node = root
+
+            for k, t in enumerate(key):
+                child = node.goto.get(t)
+
+                if child is None:
+                    child = Node(key[:k+1])
+                    node.add_child(child)
+                    changed_goto.append(node)
+                    created.append(child)
+                    parents[id(child)] = node
+
+                node = child
+
+            if not node.in_keys:
+                node.in_keys = True
+                changed_in_keys.append(node)
+
+        # Existing nodes ending with a created node, found through the
+        # failure subtrees from before the insertion (a string property
+        # that new nodes do not change). Shallower nodes first, so the
+        # longest new suffix of an existing node wins.
+        created.sort(key=lambda node: len(node.key))
+        created_ids = {id(node) for node in created}
+        ends_with = {}
+        redirected = {}
+
+        for node in created:
+            parent = parents[id(node)]
+            t = node.key[-1]
+
+            if parent is root:
+                node.suffix = root
+            else:
+                suffix = parent.suffix
+
+                while suffix is not None and t not in suffix.goto:
+                    suffix = suffix.suffix
+
+                node.suffix = root if suffix is None else suffix.goto[t]
+
+            if id(parent) in created_ids:
+                sources = ends_with[id(parent)]
+            else:
+                sources = self.fail_subtree(parent, fail_childs)
+
+            ends_with[id(node)] = ends = []
+
+            for source in sources:
+                child = source.goto.get(t)
+
+                if child is None or id(child) in created_ids:
+                    continue
+
+                ends.append(child)
+
+                if len(child.suffix.key) < len(node.key):
+                    redirected.setdefault(
+                        id(child),
+                        (child, child.suffix)
+                    )
+                    child.suffix = node
+
+        for node, suffix in redirected.values():
+            self.unlink_fail_child(fail_childs, node, suffix)
+            fail_childs[id(node.suffix)].append(node)
+            changed_suffix.append(node)
+
+        for node in created:
+            fail_childs[id(node.suffix)].append(node)
+
+        changed_suffix.extend(created)
+
+        for node in self.fail_subtrees(
+            changed_suffix + changed_in_keys,
+            fail_childs
+        ):
+            suffix = node.suffix
+
+            if suffix is not None:
+                node.key_suffix = (
+                    suffix if suffix.in_keys else suffix.key_suffix
+                )
+
+        if self.mode == 'dfa':
+            alphabet = set(root.delta)
+
+            for node in created:
+                alphabet.update(node.key[-1:])
+
+            if alphabet != set(root.delta):
+                changed_goto.append(root)
+
+            for node in self.fail_subtrees(
+                changed_suffix + changed_goto,
+                fail_childs
+            ):
+                if node is root:
+                    node.delta = {
+                        t: node.goto.get(t, root)
+                        for t in alphabet
+                    }
+                else:
+                    delta = dict(node.suffix.delta)
+                    delta.update(node.goto)
+                    node.delta = delta
+
+        self.fail_childs = fail_childs
+        return KeySnapshot(root, None, payloads, priority)
+
+    def clone_tree(self) -> tuple:
+        """
+        Copy of the Node tree, with the reverse failure links of the
+        copy as built by index_fail_childs.
+        """
+        nodes = list(
+            self.iter_nodes()
+        )
+        clones = {
+            id(node): Node(node.key, node.in_keys)
+            for node in nodes
+        }
+        fail_childs = defaultdict(list)
+
+        for node in nodes:
+            clone = clones[id(node)]
+
+            for child in node.goto.values():
+                clone.add_child(
+                    clones[id(child)]
+                )
+
+            if node.suffix is not None:
+                clone.suffix = clones[id(node.suffix)]
+                fail_childs[id(clone.suffix)].append(clone)
+
+            if node.key_suffix is not None:
+                clone.key_suffix = clones[id(node.key_suffix)]
+
+            if node.delta is not None:
+                clone.delta = {
+                    t: clones[id(target)]
+                    for t, target in node.delta.items()
+                }
+
+        return clones[id(self.tree)], fail_childs
+
+    def index_fail_childs(self, root: Node) -> defaultdict:
+        fail_childs = defaultdict(list)
+
+        for node in self.iter_nodes(root):
+            if node.suffix is not None:
+                fail_childs[id(node.suffix)].append(node)
+
+        return fail_childs
+
+    def unlink_fail_child(
+        self,
+        fail_childs: defaultdict,
+        node: Node,
+        suffix: Node = None
+    ):
+        suffix = suffix or node.suffix
+        fail_childs[id(suffix)] = [
+            child
+            for child in fail_childs[id(suffix)]
+            if child is not node
+        ]
+
+    def fail_subtree(self, node: Node, fail_childs: defaultdict) -> list:
+        """
+        Nodes whose suffix chain goes through node, node included.
+        """
+        nodes = [node]
+
+        for node in nodes:
+            nodes.extend(
+                fail_childs.get(id(node), ())
+            )
+
+        return nodes
+
+    def fail_subtrees(self, nodes: list, fail_childs: defaultdict) -> list:
+        """
+        Union of the failure subtrees of nodes, shallowest nodes first,
+        so suffixes are always handled before.
+        """
+        seen = {}
+
+        for node in nodes:
+            if id(node) in seen:
+                continue
+
+            for child in self.fail_subtree(node, fail_childs):
+                seen[id(child)] = child
+
+        return sorted(
+            seen.values(),
+            key=lambda node: len(node.key)
+        )
+
+    def find_in(self, text: str, match_kind: str = 'standard') -> dict:
+        text = self.symbols(text)
+
+        if self.stats is not None or match_kind != 'standard':
+            output = defaultdict(list)
+
+            for start, _, key in self.iter_matches(text, match_kind):
+                output[key].append(start)
+
+            return output
+        elif self.automaton is not None:
+            return self.automaton.find_in(text)
+
+        snapshot = self.reading()
+
+        try:
+            return self.find_in_tree(text, snapshot.tree)
+        finally:
+            self.release(snapshot)
+
+    def find_in_tree(self, text: str, root: Node) -> dict:
+        output = defaultdict(list)
+        node = root
+
+        if self.mode == 'dfa':
+            for i, t in enumerate(text):
+                node = node.delta.get(t, root)
+
+                if node.in_keys:
+                    key = node.key
+                    output[key].append(
+                        i - len(key) + 1
+                    )
+
+                key_suffix = node.key_suffix
+
+                while key_suffix:
+                    key = key_suffix.key
+                    output[key].append(
+                        i - len(key) + 1
+                    )
+                    key_suffix = key_suffix.key_suffix
+
+            return output
+
+        for i, t in enumerate(text):
+            while node:
+                child = node.goto.get(t)
+
+                if child is None:
+                    node = node.suffix
+                    continue
+
+                if child.in_keys:
+                    key = child.key
+                    output[key].append(
+                        i - len(key) + 1
+                    )
+
+                key_suffix = child.key_suffix
+
+                while key_suffix:
+                    key = key_suffix.key
+                    output[key].append(
+                        i - len(key) + 1
+                    )
+                    key_suffix = key_suffix.key_suffix
+
+                node = child
+                break
+            else:
+                node = root
+
+        return output
+
+    def symbols(self, text):
+        """
+        Return text as a sequence of symbols of this automaton. Str keys
+        take str texts. Bytes keys take any bytes-like text (bytes,
+        bytearray, memoryview, mmap) and scan it byte by byte through a
+        memoryview, so nothing is copied and offsets are byte positions.
+        The dna backend with str keys also takes a PackedStrand.
+        """
+        if isinstance(text, str):
+            if self.binary:
+                raise TypeError('Binary keys need a bytes-like text')
+
+            return text
+        elif isinstance(text, PackedStrand):
+            if self.backend != 'dna' or self.binary:
+                raise TypeError('PackedStrand needs the dna backend, str keys')
+
+            return text
+        elif not self.binary:
+            raise TypeError('Str keys need a str text, build with bytes keys')
+        elif isinstance(text, (bytes, bytearray)):
+            return text
+
+        return memoryview(text).cast('B')
+
+    def scan(self, text: str, state=None, snapshot: KeySnapshot = None):
+        """
+        Yield (i, state) for every position i of text whose state ends
+        at least one key, starting from state (the root when None), and
+        return the state after the last position. A state is only valid
+        in the snapshot it was reached in, given as snapshot when it is
+        not the current one.
+        """
+        text = self.symbols(text)
+        automaton = (snapshot or self.snapshot).automaton
+
+        if self.stats is not None:
+            return self.scan_with_stats(text, state, snapshot)
+        elif automaton is not None:
+            return automaton.scan(
+                text,
+                0 if state is None else state
+            )
+
+        return self.scan_tree(text, state, snapshot)
+
+    def scan_tree(
+        self,
+        text: str,
+        node: Node = None,
+        snapshot: KeySnapshot = None
+    ):
+        snapshot = self.reading(snapshot)
+        root = snapshot.tree
+
+        if node is None:
+            node = root
+
+        try:
+            if self.mode == 'dfa':
+                for i, t in enumerate(text):
+                    node = node.delta.get(t, root)
+
+                    if node.in_keys or node.key_suffix:
+                        yield i, node
+
+                return node
+
+            for i, t in enumerate(text):
+                while node:
+                    child = node.goto.get(t)
+
+                    if child is None:
+                        node = node.suffix
+                        continue
+
+                    node = child
+                    break
+                else:
+                    node = root
+
+                if node.in_keys or node.key_suffix:
+                    yield i, node
+
+            return node
+        finally:
+            self.release(snapshot)
+
+    def scan_with_stats(
+        self,
+        text: str,
+        state=None,
+        snapshot: KeySnapshot = None
+    ):
+        """
+        Same as scan, but walks the automaton one generic step at a time
+        to count its work in self.stats. Only used when stats are enabled,
+        so the plain scan loops stay free of any bookkeeping.
+        """
+        stats = self.stats
+        snapshot = self.reading(snapshot)
+        automaton = snapshot.automaton
+
+        if automaton is None:
+            root = snapshot.tree
+
+            def goto(node, t):
+                return node.goto.get(t)
+
+            def fail(node):
+                return node.suffix
+
+            def delta(node, t):
+                return node.delta.get(t, root)
+
+            def is_key(node):
+                return node.in_keys
+
+            outputs = self.outputs
+        else:
+            root = 0
+            get = automaton.alphabet.get
+            sigma = len(automaton.alphabet)
+
+            def goto(s, t):
+                c = get(t)
+                s = -1 if c is None else automaton.goto(s, c)
+                return None if s < 0 else s
+
+            def fail(s):
+                return automaton.fail[s] if s else None
+
+            def delta(s, t):
+                c = get(t)
+                return root if c is None else automaton.delta[s*sigma + c]
+
+            def is_key(s):
+                return automaton.pattern[s] >= 0
+
+            outputs = automaton.outputs
+
+        if state is None:
+            state = root
+
+        try:
+            for i, t in enumerate(text):
+                stats.characters += 1
+
+                if self.mode == 'dfa':
+                    state = delta(state, t)
+                    stats.goto_hits += 1
+                else:
+                    while True:
+                        child = goto(state, t)
+
+                        if child is not None:
+                            state = child
+                            stats.goto_hits += 1
+                            break
+
+                        suffix = fail(state)
+
+                        if suffix is None:
+                            state = root
+                            break
+
+                        state = suffix
+                        stats.failure_hops += 1
+
+                matches = sum(1 for _ in outputs(state))
+
+                if matches:
+                    stats.matches += matches
+                    stats.output_links += matches - is_key(state)
+                    yield i, state
+
+            return state
+        finally:
+            self.release(snapshot)
+
+    def outputs(self, state):
+        """
+        Yield every key ending at state, longest first.
+        """
+        if self.automaton is not None:
+            yield from self.automaton.outputs(state)
+            return
+
+        if state.in_keys:
+            yield state.key
+
+        state = state.key_suffix
+
+        while state:
+            yield state.key
+            state = state.key_suffix
+
+    def iter_matches(self, text: str, match_kind: str = 'standard'):
+        """
+        Lazily yield (start, end, key) for every key found in text, end
+        being exclusive. The standard match kind yields every overlapping
+        occurrence, in order of end position and longest key first; the
+        leftmost kinds (see MATCH_KINDS) yield non-overlapping matches in
+        order of start position.
+        """
+        if match_kind == 'standard':
+            return self.iter_overlapping(text)
+        elif match_kind in MATCH_KINDS:
+            return self.iter_leftmost(
+                text,
+                match_kind == 'leftmost-longest'
+            )
+
+        raise ValueError(f'Unknown match kind: {match_kind!r}')
+
+    def iter_overlapping(self, text: str):
+        # States of an array automaton are only valid in the automaton
+        # scanned, which an update may have replaced since.
+        automaton = self.automaton
+        outputs = self.outputs if automaton is None else automaton.outputs
+
+        for i, state in self.scan(text):
+            end = i + 1
+
+            for key in outputs(state):
+                yield end - len(key), end, key
+
+    def iter_leftmost(self, text: str, longest: bool = True):
+        """
+        Yield the leftmost non-overlapping (start, end, key) of text,
+        ties at the same start going to the longest key, or to the key
+        given first when not longest.
+
+        The scan restarts from the root at the end of every match, so
+        the longest key ending at a state is the only one to look at
+        and the key_suffix chain is never walked. A match is yielded as
+        soon as the depth of the current state shows that no key can
+        start before it. Scan stats are not recorded.
+        """
+        text = self.symbols(text)
+        snapshot = self.reading()
+
+        try:
+            yield from self.iter_leftmost_in(text, longest, snapshot)
+        finally:
+            self.release(snapshot)
+
+    def iter_leftmost_in(
+        self,
+        text: str,
+        longest: bool,
+        snapshot: KeySnapshot
+    ):
+        if snapshot.priority is None:
+            def rank(key):
+                return key
+        else:
+            rank = snapshot.priority.__getitem__
+
+        if snapshot.automaton is not None:
+            yield from snapshot.automaton.iter_leftmost(text, longest, rank)
+            return
+
+        dfa = self.mode == 'dfa'
+        root = node = snapshot.tree
+        match = None
+        n = len(text)
+        i = 0
+
+        while True:
+            if i < n:
+                t = text[i]
+
+                if dfa:
+                    node = node.delta.get(t, root)
+                else:
+                    while node:
+                        child = node.goto.get(t)
+
+                        if child is None:
+                            node = node.suffix
+                            continue
+
+                        node = child
+                        break
+                    else:
+                        node = root
+            elif match is None:
+                return
+
+            if match is not None and (
+                i == n or i - len(node.key) >= match[0]
+            ):
+                yield match
+                i = match[1]
+                node = root
+                match = None
+                continue
+
+            found = node if node.in_keys else node.key_suffix
+
+            if found is not None:
+                key = found.key
+                start = i - len(key) + 1
+
+                if match is None or start < match[0] or (
+                    start == match[0]
+                    and (longest or rank(key) < rank(match[2]))
+                ):
+                    match = start, i + 1, key
+
+            i += 1
+
+    def count_states(self, text: str) -> dict:
+        """
+        Map id of every state ending a key (the state itself for the
+        array backend) to [state, number of times text reaches it].
+        """
+        states = {}
+
+        for _, state in self.scan(text):
+            k = id(state) if self.automaton is None else state
+            counted = states.get(k)
+
+            if counted is None:
+                states[k] = [state, 1]
+            else:
+                counted[1] += 1
+
+        return states
+
+    def count_in(self, text: str) -> dict:
+        """
+        Number of occurrences of every key found in text, without
+        building position lists.
+        """
+        counts = defaultdict(int)
+
+        for state, count in self.count_states(text).values():
+            for key in self.outputs(state):
+                counts[key] += count
+
+        return counts
+
+    def score_in(self, text: str, weights: dict = None):
+        """
+        Sum of the weight of every key occurrence in text. Weights
+        default to the payloads given with the keys; keys without a
+        weight count as 0.
+        """
+        weights = self.payloads if weights is None else weights
+        return sum(
+            count * sum(
+                weights.get(key, 0)
+                for key in self.outputs(state)
+            )
+            for state, count in self.count_states(text).values()
+        )
+
+    def keys_in(self, text: str) -> set:
+        return {
+            key
+            for state, _ in self.count_states(text).values()
+            for key in self.outputs(state)
+        }
+
+    def first_match(self, text: str):
+        """
+        Return the first (start, end, key) of iter_matches, or None,
+        without scanning the rest of text.
+        """
+        for match in self.iter_matches(text):
+            return match
+
+        return None
+
+    def contains_any(self, text: str) -> bool:
+        for _ in self.scan(text):
+            return True
+
+        return False
+
+    def stream(self):
+        return StreamMatcher(self)
+
+    def batch(self):
+        return BatchScanner(self)
+
+    def iter_file_matches(
+        self,
+        path: str,
+        block_size: int = BLOCK_SIZE,
+        encoding: str = 'utf-8'
+    ):
+        """
+        Yield (start, end, key) for every key found in the file at path,
+        reading it block_size characters at a time. Binary automata read
+        the file in binary mode and report byte offsets.
+        """
+        if self.binary:
+            content = open(path, 'rb')
+        else:
+            content = open(path, 'r', encoding=encoding)
+
+        with content, self.stream() as matcher:
+            while True:
+                chunk = content.read(block_size)
+
+                if not chunk:
+                    break
+
+                yield from matcher.feed(chunk)
+
+    def replace(
+        self,
+        text: str,
+        replacements,
+        match_kind: str = 'leftmost-longest'
+    ):
+        """
+        Return text with every match replaced in a single scan, overlaps
+        being resolved by match_kind, one of the leftmost kinds.
+        Replacements map every key to its replacement, or are a function
+        of the key, e.g. lambda key: '*' * len(key) to redact.
+        """
+        text = self.symbols(text)
+        empty = b'' if self.binary else ''
+        return empty.join(
+            self.iter_replaced(text, replacements, match_kind)
+        )
+
+    def replace_stream(
+        self,
+        chunks,
+        replacements,
+        target,
+        match_kind: str = 'leftmost-longest'
+    ) -> int:
+        """
+        Same as replace over the concatenation of chunks, writing the
+        result to the file-like target as the chunks are read. Only the
+        last max_key_length - 1 characters of a chunk, which a match of
+        the next one could start in, are held back. Return the number
+        of replaced matches.
+        """
+        tail = self.max_key_length() - 1
+        carry = None
+        count = 0
+
+        def write(pieces):
+            while True:
+                try:
+                    piece = next(pieces)
+                except StopIteration as stop:
+                    return stop.value
+
+                if piece:
+                    target.write(piece)
+
+        for chunk in chunks:
+            chunk = self.symbols(chunk)
+            text = carry + chunk if carry else chunk
+            position, replaced = write(
+                self.iter_replaced(
+                    text,
+                    replacements,
+                    match_kind,
+                    len(text) - tail
+                )
+            )
+            count += replaced
+            carry = text[position:]
+
+            if isinstance(carry, memoryview):
+                carry = bytes(carry)
+
+        if carry:
+            count += write(
+                self.iter_replaced(carry, replacements, match_kind)
+            )[1]
+
+        return count
+
+    def iter_replaced(
+        self,
+        text: str,
+        replacements,
+        match_kind: str,
+        stop: int = None
+    ):
+        """
+        Yield the pieces of text up to stop (its end when None), with
+        every match starting before stop replaced, and return where
+        the pieces ended (stop, or the end of a match crossing it) and
+        the number of replaced matches.
+        """
+        if match_kind == 'standard':
+            raise ValueError('Overlapping matches can not be replaced')
+
+        if callable(replacements):
+            replacement = replacements
+        else:
+            replacement = replacements.__getitem__
+
+        if stop is None:
+            stop = len(text)
+
+        position = 0
+        count = 0
+
+        for start, end, key in self.iter_matches(text, match_kind):
+            if start >= stop:
+                break
+
+            yield text[position:start]
+            yield replacement(key)
+            position = end
+            count += 1
+
+        end = max(position, stop)
+        yield text[position:end]
+        return end, count
+
+    def save(self, path: str):
+        """
+        Write the automaton to path in the versioned binary format
+        read by AhoCorasick.load. A Node tree is converted to the
+        array layout first.
+        """
+        automaton = self.automaton
+
+        if automaton is None:
+            automaton = CompactAutomaton(
+                node.key
+                for node in self.iter_nodes()
+                if node.in_keys
+            )
+
+            if self.mode == 'dfa':
+                automaton.build_dfa()
+
+        automaton.save(path)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True):
+        """
+        Load an automaton written by AhoCorasick.save. With mmap the
+        tables stay in the page cache and are shared by every process
+        loading the same file; keys are decoded lazily.
+        """
+        self = cls.__new__(cls)
+        # The order keys were given in is not saved: leftmost-first
+        # ranks the keys of a loaded automaton in sorted order.
+        self.snapshot = KeySnapshot(
+            None,
+            CompactAutomaton.load(path, mmap),
+            {},
+            None
+        )
+        self.backend = 'array'
+        self.mode = 'lazy' if self.automaton.delta is None else 'dfa'
+        self.binary = self.automaton.binary
+        self.build_seconds = {}
+        self.stats = None
+        self.fail_childs = None
+        self.lock = Lock()
+        return self
+
+    def find_in_many(
+        self,
+        documents,
+        workers: int = None,
+        chunksize: int = 64,
+        ordered: bool = True,
+        executor: str = 'process'
+    ):
+        """
+        Lazily run find_in over every document of an iterable in a pool
+        of processes (each loading the automaton once from a memory-mapped
+        file) or threads.
+
+        Documents are sent chunksize at a time and at most two chunks per
+        worker are in flight, so a generator of documents is consumed only
+        as fast as results are taken. When ordered, the find_in outputs
+        are yielded in input order, otherwise (index, output) pairs are
+        yielded as soon as their chunk is done.
+        """
+        if executor not in ('process', 'thread'):
+            raise ValueError(f'Unknown executor: {executor!r}')
+
+        workers = workers or cpu_count() or 1
+        documents = iter(documents)
+        chunks = iter(
+            lambda: list(
+                islice(documents, chunksize)
+            ),
+            []
+        )
+
+        with TemporaryDirectory() as directory:
+            if executor == 'thread':
+                pool = ThreadPoolExecutor(workers)
+                aho_corasick = self
+            else:
+                path = join(directory, 'automaton.ac')
+                self.save(path)
+                pool = ProcessPoolExecutor(
+                    workers,
+                    initializer=load_worker_automaton,
+                    initargs=(path,)
+                )
+                aho_corasick = None
+
+            with pool:
+                pending = {}
+                index = 0
+
+                while True:
+                    for chunk in islice(chunks, 2 * workers - len(pending)):
+                        future = pool.submit(
+                            find_in_documents,
+                            chunk,
+                            aho_corasick
+                        )
+                        pending[future] = index
+                        index += len(chunk)
+
+                    if not pending:
+                        break
+                    elif ordered:
+                        # Dicts keep insertion order, which is input order.
+                        done = [next(iter(pending))]
+                    else:
+                        done, _ = wait(
+                            pending,
+                            return_when=FIRST_COMPLETED
+                        )
+
+                    for future in done:
+                        start = pending.pop(future)
+
+                        for k, found in enumerate(future.result()):
+                            yield found if ordered else (start + k, found)
+
+    def max_key_length(self) -> int:
+        if self.automaton is not None:
+            return max(map(len, self.automaton.keys), default=0)
+
+        return max(
+            (len(node.key) for node in self.iter_nodes()),
+            default=0
+        )
+
+    def find_in_parallel(self, text: str, workers: int = None) -> dict:
+        """
+        Same output as find_in, computed by a pool of worker processes.
+
+        The text is split into one segment per worker, each extended by
+        the longest key length minus one so keys crossing a boundary are
+        still found; a match is only kept by the segment it starts in.
+        Workers memory-map one saved copy of the automaton.
+        """
+        text = self.symbols(text)
+        workers = workers or cpu_count() or 1
+        overlap = max(self.max_key_length() - 1, 0)
+        size = -(-len(text) // workers)
+
+        if workers == 1 or size <= overlap:
+            return self.find_in(text)
+
+        tasks = []
+
+        for start in range(0, len(text), size):
+            segment = text[start:start + size + overlap]
+
+            if isinstance(segment, memoryview):
+                segment = bytes(segment)
+
+            tasks.append(
+                (segment, start, size)
+            )
+
+        output = defaultdict(list)
+
+        with TemporaryDirectory() as directory:
+            path = join(directory, 'automaton.ac')
+            self.save(path)
+
+            with ProcessPoolExecutor(
+                workers,
+                initializer=load_worker_automaton,
+                initargs=(path,)
+            ) as executor:
+                for found in executor.map(find_in_segment, tasks):
+                    for key, starts in found.items():
+                        if starts:
+                            output[key].extend(starts)
+
+        return output
+
+    def are_keys_found_equal_to(
+        self,
+        text: str,
+        other_keys_found: dict
+    ) -> bool:
+        k1 = self.find_in(text)
+        k2 = other_keys_found
+        k1_keys = k1.keys()
+
+        if len(k1) != len(k2):
+            return False
+        elif k1_keys != k2.keys():
+            return False
+
+        for key in k1_keys:
+            get_k1_key = k1[key]
+            get_k2_key = k2[key]
+            len_k1_key = len(get_k1_key)
+
+            if len_k1_key != len(k2[key]):
+                return False
+
+            for k in range(len_k1_key):
+                if get_k1_key[k] != get_k2_key[k]:
+                    return False
+
+        return True
+
+
+class AutomatonCache:
+    """
+    LRU cache of built AhoCorasick automata, keyed by digest_keys of
+    their keys, payloads and build options.
+
+    The cache is bounded by the total number of states and/or bytes
+    (AhoCorasick.states and nbytes) of the automata it holds; the least
+    recently used ones are evicted first, and an automaton larger than
+    the bound is returned without being cached. Automata are shared by
+    every caller getting the same keys, so they should not be updated
+    in place. As the digest is over the set of keys, leftmost-first
+    ranks keys in the order of the first build.
+    """
+
+    def __init__(self, max_states: int = None, max_bytes: int = None):
+        self.max_states = max_states
+        self.max_bytes = max_bytes
+        self.entries = {}
+        self.states = 0
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, keys, **options) -> AhoCorasick:
+        """
+        Return the cached AhoCorasick(keys, **options), building it on
+        a miss.
+        """
+        # Keys are read twice, for the digest then the build.
+        keys = keys if isinstance(keys, dict) else list(keys)
+        digest = digest_keys(keys, **options)
+
+        with self.lock:
+            entry = self.entries.pop(digest, None)
+
+            if entry is not None:
+                self.entries[digest] = entry
+                self.hits += 1
+                return entry[0]
+
+            self.misses += 1
+
+        aho_corasick = AhoCorasick(keys, **options)
+        states = aho_corasick.states()
+        nbytes = aho_corasick.nbytes() if self.max_bytes else 0
+
+        if (
+            (self.max_states is not None and states > self.max_states)
+            or (self.max_bytes is not None and nbytes > self.max_bytes)
+        ):
+            return aho_corasick
+
+        with self.lock:
+            if digest not in self.entries:
+                self.entries[digest] = aho_corasick, states, nbytes
+                self.states += states
+                self.nbytes += nbytes
+                self.evict()
+
+        return aho_corasick
+
+    def evict(self):
+        while self.entries and (
+            (self.max_states is not None and self.states > self.max_states)
+            or (self.max_bytes is not None and self.nbytes > self.max_bytes)
+        ):
+            _, states, nbytes = self.entries.pop(
+                next(iter(self.entries))
+            )
+            self.states -= states
+            self.nbytes -= nbytes
+            self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.states = 0
+            self.nbytes = 0
+
+    def info(self) -> dict:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(self.entries),
+            'states': self.states,
+            'bytes': self.nbytes
+        }
+
+
+class StreamMatcher:
+    """
+    Incremental matcher over a text given chunk by chunk.
+
+    The automaton state and the number of characters seen so far are
+    carried between feed calls, so keys crossing a chunk boundary are
+    found and every match is reported with its offset in the whole text.
+
+    The first feed takes the current KeySnapshot of the automaton (see
+    AhoCorasick.reading), and the whole text is scanned with its keys
+    until close, even when keys are updated in between. Feeding after
+    close starts a new text.
+    """
+
+    def __init__(self, aho_corasick: AhoCorasick):
+        self.aho_corasick = aho_corasick
+        self.snapshot = None
+        self.state = None
+        self.offset = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def feed(self, chunk: str) -> list:
+        """
+        Scan the next chunk and return its matches as a list of
+        (start, end, key), end being exclusive.
+        """
+        aho_corasick = self.aho_corasick
+
+        if self.snapshot is None:
+            self.snapshot = aho_corasick.reading()
+
+        automaton = self.snapshot.automaton
+        matches = []
+        offset = self.offset
+        chunk = aho_corasick.symbols(chunk)
+        scan = aho_corasick.scan(chunk, self.state, self.snapshot)
+
+        # States of an array automaton are only valid in its own tables.
+        if automaton is None:
+            outputs = aho_corasick.outputs
+        else:
+            outputs = automaton.outputs
+
+        while True:
+            try:
+                i, state = next(scan)
+            except StopIteration as stop:
+                self.state = stop.value
+                break
+
+            end = offset + i + 1
+
+            for key in outputs(state):
+                matches.append(
+                    (end - len(key), end, key)
+                )
+
+        self.offset = offset + len(chunk)
+        return matches
+
+    def close(self):
+        """
+        Release the snapshot of the automaton, so updates of its keys
+        no longer copy a tree kept for this text.
+        """
+        if self.snapshot is not None:
+            self.aho_corasick.release(self.snapshot)
+
+        self.snapshot = None
+        self.state = None
+        self.offset = 0
+
+
+class BatchScanner:
+    """
+    Scanner of many texts of the same length at once, with NumPy.
+
+    The texts are stacked into a 2-D array of symbol codes, and the
+    states of all of them advance together: every position is one
+    gather in a dense states * (alphabet + 1) transition table, whose
+    last column sends unknown symbols back to the root. Keys ending at
+    the new states are added to a texts * keys counts matrix, one output
+    link at a time for all texts. Columns are in the order of self.keys.
+    """
+
+    def __init__(self, aho_corasick: AhoCorasick):
+        if numpy is None:
+            raise ImportError('BatchScanner needs numpy')
+
+        automaton = aho_corasick.automaton
+
+        if automaton is None or automaton.delta is None:
+            if automaton is None:
+                keys = [
+                    node.key
+                    for node in aho_corasick.iter_nodes()
+                    if node.in_keys
+                ]
+            else:
+                keys = list(automaton.keys)
+
+            automaton = CompactAutomaton(keys)
+            automaton.build_dfa()
+
+        self.aho_corasick = aho_corasick
+        self.binary = automaton.binary
+        self.keys = list(automaton.keys)
+        self.symbols = numpy.array(
+            [
+                t if self.binary else ord(t)
+                for t in automaton.alphabet
+            ],
+            numpy.uint32
+        )
+        sigma = len(self.symbols)
+        states = automaton.states()
+        self.delta = numpy.zeros((states, sigma + 1), numpy.int32)
+        self.delta[:, :sigma] = numpy.frombuffer(
+            automaton.delta,
+            numpy.int32
+        ).reshape(states, sigma)
+        self.pattern = numpy.frombuffer(automaton.pattern, numpy.int32)
+        self.link = numpy.frombuffer(automaton.output, numpy.int32)
+        # First state of the output chain of every state, or -1.
+        self.first = numpy.where(
+            self.pattern >= 0,
+            numpy.arange(states, dtype=numpy.int32),
+            self.link
+        )
+
+    def encode(self, texts: list):
+        """
+        Stack texts into a texts * length array of symbol codes, the
+        codes of unknown symbols being len(self.symbols).
+        """
+        length = len(texts[0]) if texts else 0
+
+        if any(len(text) != length for text in texts):
+            raise ValueError('Texts should all have the same length')
+        elif not length:
+            return numpy.zeros((len(texts), 0), numpy.uint8)
+
+        if self.binary:
+            points = numpy.frombuffer(
+                b''.join(map(bytes, texts)),
+                numpy.uint8
+            )
+        else:
+            points = numpy.array(texts, f'U{length}').view(numpy.uint32)
+
+        points = points.reshape(len(texts), length)
+        sigma = len(self.symbols)
+        codes = numpy.searchsorted(self.symbols, points)
+        known = codes < sigma
+        known[known] = self.symbols[codes[known]] == points[known]
+        codes[~known] = sigma
+        return codes.astype(
+            numpy.uint8 if sigma < 256 else numpy.int32
+        )
+
+    def counts(self, texts: list):
+        """
+        Number of occurrences of every key of self.keys in every text,
+        as a texts * keys matrix.
+        """
+        codes = self.encode(texts)
+        n, length = codes.shape
+        k = len(self.keys)
+        counts = numpy.zeros(n * k, numpy.int64)
+        rows = numpy.arange(n) * k
+        state = numpy.zeros(n, numpy.int32)
+
+        for column in codes.T.copy():
+            state = self.delta[state, column]
+            hit = self.first[state]
+            found = hit >= 0
+            row = rows[found]
+            hit = hit[found]
+
+            # Every text appears once per output link, so the indices
+            # are unique and a plain fancy += counts them all.
+            while hit.size:
+                counts[row + self.pattern[hit]] += 1
+                hit = self.link[hit]
+                found = hit >= 0
+                row = row[found]
+                hit = hit[found]
+
+        return counts.reshape(n, k)
+
+    def scores(self, texts: list, weights: dict = None):
+        """
+        Sum of the weight of every key occurrence in every text, as a
+        vector. Weights default to the payloads of the keys.
+        """
+        if weights is None:
+            weights = self.aho_corasick.payloads
+
+        return self.counts(texts) @ numpy.array(
+            [weights.get(key, 0) for key in self.keys]
+        )
+
+
+class ShiftAnd:
+    """
+    Bit-parallel Shift-And search of a few short keys.
+
+    The keys are laid end to end in the bits of one Python int: bit j
+    of the state is set when the last characters read match the first
+    characters of a key up to bit j. A character is one shift, or and
+    and with its mask, whatever the number of keys.
+    """
+
+    def __init__(self, keys: list):
+        keys = list(
+            dict.fromkeys(key for key in keys if key)
+        )
+        self.binary = keys_are_binary(keys)
+        self.masks = {}
+        self.starts = 0
+        self.finals = 0
+        self.keys = {}
+        bit = 0
+
+        for key in keys:
+            for j, t in enumerate(key):
+                self.masks[t] = self.masks.get(t, 0) | 1 << (bit + j)
+
+            bit += len(key)
+            self.starts |= 1 << (bit - len(key))
+            self.finals |= 1 << (bit - 1)
+            self.keys[bit - 1] = key
+
+    def find_in(self, text: str) -> dict:
+        output = defaultdict(list)
+        get = self.masks.get
+        starts = self.starts
+        finals = self.finals
+        keys = self.keys
+        state = 0
+
+        if not isinstance(text, (str, bytes, bytearray)):
+            text = memoryview(text).cast('B')
+
+        for i, t in enumerate(text):
+            state = ((state << 1) | starts) & get(t, 0)
+
+            if state & finals:
+                found = state & finals
+
+                while found:
+                    bit = found & -found
+                    key = keys[bit.bit_length() - 1]
+                    output[key].append(
+                        i - len(key) + 1
+                    )
+                    found ^= bit
+
+        return output
+
+
+class SubstringSearch:
+    """
+    Search of every key on its own with str.find (or bytes.find), whose
+    C implementation skips ahead on mismatches and so reads only part
+    of the text for long keys. One pass per key, which pays off while
+    there are few keys.
+    """
+
+    def __init__(self, keys: list):
+        self.keys = list(
+            dict.fromkeys(key for key in keys if key)
+        )
+        self.binary = keys_are_binary(self.keys)
+
+    def find_in(self, text: str) -> dict:
+        output = defaultdict(list)
+
+        if not hasattr(text, 'find'):
+            text = bytes(text)
+
+        find = text.find
+
+        for key in self.keys:
+            i = find(key)
+
+            if i >= 0:
+                starts = output[key]
+
+                while i >= 0:
+                    starts.append(i)
+                    i = find(key, i + 1)
+
+        return output
+
+
+class Searcher:
+    """
+    Front-end picking the search engine of a set of keys at build time,
+    all of them giving the find_in output of AhoCorasick:
+
+    - 'find': SubstringSearch, for up to SEARCH_FIND_MAX_KEYS keys, or
+      up to 4 times as many over an alphabet of more than 16 symbols.
+    - 'aho-corasick': AhoCorasick built with options, otherwise.
+    - 'shift-and': ShiftAnd, only when forced. In CPython the work per
+      character is the interpreter's, so it never beat the DFA walk.
+
+    engine forces one of SEARCH_ENGINES instead of 'auto', e.g. to
+    benchmark the engines against each other.
+    """
+
+    def __init__(self, keys: list, engine: str = 'auto', **options):
+        keys = list(keys)
+
+        if engine == 'auto':
+            engine = self.select_engine(keys)
+        elif engine not in SEARCH_ENGINES:
+            raise ValueError(f'Unknown engine: {engine!r}')
+
+        self.engine = engine
+
+        if engine == 'find':
+            self.matcher = SubstringSearch(keys)
+        elif engine == 'shift-and':
+            self.matcher = ShiftAnd(keys)
+        else:
+            self.matcher = AhoCorasick(keys, **options)
+
+    @staticmethod
+    def select_engine(keys: list) -> str:
+        count = len(
+            {key for key in keys if key}
+        )
+        alphabet = {t for key in keys for t in key}
+
+        if count <= SEARCH_FIND_MAX_KEYS or (
+            count <= 4 * SEARCH_FIND_MAX_KEYS and len(alphabet) > 16
+        ):
+            return 'find'
+
+        return 'aho-corasick'
+
+    def find_in(self, text: str) -> dict:
+        return self.matcher.find_in(text)
+
+
+class SuffixArray:
+    """
+    Index of one text answering find_in queries for any batch of keys,
+    the complement of AhoCorasick when the text is fixed and the keys
+    change.
+
+    sa lists the start of every suffix of text in sorted order, so the
+    occurrences of a key are the contiguous range of suffixes it is a
+    prefix of: two binary searches comparing O(len(key)) slices, then
+    the occurrences themselves. The text is str, or bytes for binary
+    indexes; offsets are those of find_in.
+    """
+
+    def __init__(self, text: str):
+        if not isinstance(text, str):
+            text = bytes(text)
+
+        self.text = text
+        self.binary = isinstance(text, bytes)
+        self.sa = self.build(text)
+
+    @staticmethod
+    def build(text: str) -> array:
+        """
+        Suffix array of text by prefix doubling: suffixes sorted by
+        their first k symbols are re-sorted by the pair of ranks of
+        their first k and next k symbols, k doubling until every rank
+        is distinct.
+        """
+        n = len(text)
+        typecode = 'i' if n < 1 << 31 else 'q'
+        code = {
+            t: c
+            for c, t in enumerate(
+                sorted(
+                    set(text)
+                )
+            )
+        }
+        rank = [code[t] for t in text]
+        sa = sorted(range(n), key=rank.__getitem__)
+        k = 1
+
+        while sa and rank[sa[-1]] < n - 1:
+            pairs = [
+                rank[i] * (n + 1) + (rank[i + k] + 1 if i + k < n else 0)
+                for i in range(n)
+            ]
+            sa.sort(key=pairs.__getitem__)
+            previous = pairs[sa[0]]
+            r = 0
+
+            for i in sa:
+                if pairs[i] != previous:
+                    previous = pairs[i]
+                    r += 1
+
+                rank[i] = r
+
+            k *= 2
+
+        return array(typecode, sa)
+
+    def __len__(self) -> int:
+        return len(self.text)
+
+    def range_of(self, key: str) -> tuple:
+        """
+        Return (lo, hi) such that sa[lo:hi] are the starts of key.
+        """
+        text = self.text
+        sa = self.sa
+        m = len(key)
+        lo = 0
+        hi = len(sa)
+
+        while lo < hi:
+            mid = (lo + hi) // 2
+            i = sa[mid]
+
+            if text[i:i + m] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        first = lo
+        hi = len(sa)
+
+        while lo < hi:
+            mid = (lo + hi) // 2
+            i = sa[mid]
+
+            if text[i:i + m] <= key:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        return first, lo
+
+    def count(self, key: str) -> int:
+        lo, hi = self.range_of(key)
+        return hi - lo
+
+    def locate(self, key: str) -> list:
+        lo, hi = self.range_of(key)
+        return sorted(self.sa[lo:hi])
+
+    def find_in(self, keys: list) -> dict:
+        """
+        Same dict as AhoCorasick(keys).find_in(self.text).
+        """
+        keys = [key for key in dict.fromkeys(keys) if key]
+
+        if keys and keys_are_binary(keys) != self.binary:
+            raise TypeError('Keys should be of the same type as the text')
+
+        output = defaultdict(list)
+
+        for key in keys:
+            starts = self.locate(key)
+
+            if starts:
+                output[key] = starts
+
+        return output
+
+    def save(self, path: str):
+        """
+        Write the text and suffix array to path, read by SuffixArray.load.
+        """
+        if self.binary:
+            blob = self.text
+        else:
+            blob = self.text.encode('utf-8', 'surrogatepass')
+
+        with open(path, 'wb') as content:
+            content.write(
+                SUFFIX_HEADER.pack(
+                    SUFFIX_MAGIC,
+                    SUFFIX_VERSION,
+                    byteorder == 'big',
+                    self.sa.itemsize,
+                    self.binary,
+                    len(self.sa),
+                    len(blob)
+                )
+            )
+
+            for section in [blob, self.sa.tobytes()]:
+                content.write(section)
+                content.write(
+                    bytes(-len(section) % 8)
+                )
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True):
+        """
+        Load a SuffixArray written by save. The text is read into memory;
+        with mmap the suffix array stays in the page cache.
+        """
+        with open(path, 'rb') as content:
+            if mmap and fstat(content.fileno()).st_size:
+                buffer = memory_map(
+                    content.fileno(),
+                    0,
+                    access=ACCESS_READ
+                )
+            else:
+                buffer = content.read()
+
+        view = memoryview(buffer)
+
+        if len(view) < SUFFIX_HEADER.size:
+            raise ValueError(f'{path} is truncated')
+
+        (
+            magic,
+            version,
+            big_endian,
+            itemsize,
+            binary,
+            length,
+            blob_size
+        ) = SUFFIX_HEADER.unpack_from(view)
+
+        if magic != SUFFIX_MAGIC:
+            raise ValueError(f'{path} is not a saved SuffixArray')
+        elif version != SUFFIX_VERSION:
+            raise ValueError(
+                f'{path} has format version {version}, '
+                f'expected {SUFFIX_VERSION}'
+            )
+        elif big_endian != (byteorder == 'big'):
+            raise ValueError(f'{path} was saved with another byte order')
+
+        position = SUFFIX_HEADER.size
+        end = position + blob_size + (-blob_size % 8) + length * itemsize
+
+        if end > len(view):
+            raise ValueError(f'{path} is truncated')
+
+        blob = bytes(view[position:position + blob_size])
+        position += blob_size + (-blob_size % 8)
+
+        self = cls.__new__(cls)
+        self.buffer = buffer
+        self.binary = bool(binary)
+        self.text = blob if self.binary else str(
+            blob,
+            'utf-8',
+            'surrogatepass'
+        )
+        self.sa = view[
+            position:position + length * itemsize
+        ].cast('i' if itemsize == 4 else 'q')
+        return self
+
+
+class ShardedMatcher:
+    """
+    Key set split into shards, each one an array backend AhoCorasick
+    saved to its own file, for dictionaries too large for one automaton.
+
+    Keys go to the shard given by the CRC-32 of their UTF-8 bytes, which
+    is stable across processes and runs. find_in scans the text against
+    every shard and merges the position lists, which never collide as
+    shards hold disjoint keys. One after another, only one shard is
+    loaded at a time, so memory is capped by the largest shard; with
+    workers, every process scans a shard.
+    """
+
+    def __init__(self, paths: list):
+        self.paths = list(paths)
+
+    @staticmethod
+    def shard_of(key: str, shards: int) -> int:
+        if isinstance(key, str):
+            key = key.encode('utf-8', 'surrogatepass')
+
+        return crc32(key) % shards
+
+    @classmethod
+    def build(
+        cls,
+        keys,
+        directory: str,
+        shards: int = 4,
+        mode: str = 'lazy'
+    ):
+        """
+        Partition keys into shards, then build and save every shard in
+        directory, keeping one automaton in memory at a time. Empty
+        shards are not saved: an automaton without keys can not tell
+        str from bytes, so it would reject the texts of the others.
+        """
+        parts = [[] for _ in range(shards)]
+
+        for key in keys:
+            if key:
+                parts[cls.shard_of(key, shards)].append(key)
+
+        # Shards must agree on the type of their keys.
+        keys_are_binary(
+            key
+            for part in parts
+            for key in part
+        )
+        paths = []
+
+        for k, part in enumerate(parts):
+            if not part:
+                continue
+
+            path = join(directory, f'shard-{k:04}.ac')
+            AhoCorasick(part, mode, backend='array').save(path)
+            parts[k] = None
+            paths.append(path)
+
+        return cls(paths)
+
+    @classmethod
+    def open(cls, directory: str):
+        return cls(
+            join(directory, name)
+            for name in sorted(
+                listdir(directory)
+            )
+            if name.startswith('shard-') and name.endswith('.ac')
+        )
+
+    def find_in(self, text: str, workers: int = 1) -> dict:
+        output = defaultdict(list)
+
+        if workers == 1:
+            for path in self.paths:
+                output.update(
+                    AhoCorasick.load(path).find_in(text)
+                )
+
+            return output
+
+        with ProcessPoolExecutor(workers or cpu_count() or 1) as executor:
+            for found in executor.map(
+                find_in_shard,
+                [(path, text) for path in self.paths]
+            ):
+                output.update(found)
+
+        return output
+
+
+class Test(TestCase):
+    def test_AhoCorasick_tree_1(self):
+        self.assertEqual(
+            AhoCorasick(
+                ['']
+            ).tree == Node(),
+            True
+        )
+
+    def test_AhoCorasick_tree_2(self):
+        tree = Node()
+        a = Node('a', True, tree)
+        ab = Node('ab', True, tree)
+
+        tree.childs.add(a)
+        a.childs.add(ab)
+
+        self.assertEqual(
+            AhoCorasick(
+                ['a', 'ab']
+            ).tree == tree,
+            True
+        )
+
+    def test_AhoCorasick_tree_3(self):
+        tree = Node()
+        a = Node('a', True, tree)
+        b = Node('b', False, tree)
+        c = Node('c', True, tree)
+        ab = Node('ab', True, b)
+        ba = Node('ba', False, a, a)
+        bc = Node('bc', True, c, c)
+        ca = Node('ca', False, a, a)
+        bab = Node('bab', True, ab, ab)
+        bca = Node('bca', True, ca, a)
+        caa = Node('caa', True, a, a)
+
+        tree.childs = {a, b, c}
+        a.childs.add(ab)
+        b.childs = {ba, bc}
+        c.childs.add(ca)
+        ba.childs.add(bab)
+        bc.childs.add(bca)
+        ca.childs.add(caa)
+
+        self.assertEqual(
+            AhoCorasick(
+                ['a', 'ab', 'bab', 'bc', 'bca', 'c', 'caa']
+            ).tree == tree,
+            True
+        )
+
+    def test_AhoCorasick_tree_4(self):
+        tree = Node()
+        a = Node('a', False, tree)
+        b = Node('b', True, tree)
+        c = Node('c', True, tree)
+        d = Node('d', True, tree)
+        aa = Node('aa', True, a)
+
+        tree.childs = {a, b, c, d}
+        a.childs.add(aa)
+
+        self.assertEqual(
+            AhoCorasick(
+                ['b', 'c', 'aa', 'd', 'b']
+            ).tree == tree,
+            True
+        )
+
+    def test_AhoCorasick_tree_5(self):
+        tree = Node()
+        a = Node('a', True, tree)
+        b = Node('b', True, tree)
+        c = Node('c', True, tree)
+        d = Node('d', True, tree)
+        aa = Node('aa', True, a, a)
+
+        tree.childs = {a, b, c, d}
+        a.childs.add(aa)
+
+        self.assertEqual(
+            AhoCorasick(
+                ['a', 'b', 'c', 'aa', 'd']
+            ).tree == tree,
+            True
+        )
+
+    def test_AhoCorasick_tree_6(self):
+        tree = Node()
+        a = Node('a', False, tree)
+        c = Node('c', True, tree)
+        d = Node('d', True, tree)
+        aa = Node('aa', True, a)
+
+        tree.childs = {a, c, d}
+        a.childs.add(aa)
+
+        self.assertEqual(
+            AhoCorasick(
+                ['c', 'aa', 'd']
+            ).tree == tree,
+            True
+        )
+
+    def test_AhoCorasick_keys_found_1(self):
+        self.assertEqual(
+            AhoCorasick(
+                ['a', 'ab', 'bab', 'bc', 'bca', 'c', 'caa']
             ).are_keys_found_equal_to(
                 'abccab',
                 {
@@ -390,82 +3484,1045 @@ class Test(TestCase):
             True
         )
 
-    def test_AhoCorasick_keys_found_2(self):
+    def test_AhoCorasick_keys_found_2(self):
+        self.assertEqual(
+            AhoCorasick(
+                ['a', 'ab', 'bab', 'bc', 'bca', 'c', 'caa']
+            ).are_keys_found_equal_to(
+                'abcacaab',
+                {
+                    'a': [0, 3, 5, 6],
+                    'ab': [0, 6],
+                    'bc': [1],
+                    'bca': [1],
+                    'c': [2, 4],
+                    'caa': [4]
+                }
+            ),
+            True
+        )
+
+    def test_AhoCorasick_keys_found_3(self):
+        self.assertEqual(
+            AhoCorasick(
+                ['b', 'c', 'aa', 'd', 'b']
+            ).are_keys_found_equal_to(
+                'caaab',
+                {
+                    'aa': [1, 2],
+                    'b': [4],
+                    'c': [0]
+                }
+            ),
+            True
+        )
+
+    def test_AhoCorasick_keys_found_4(self):
+        self.assertEqual(
+            AhoCorasick(
+                ['a', 'b', 'c', 'aa', 'd']
+            ).are_keys_found_equal_to(
+                'xyz',
+                {}
+            ),
+            True
+        )
+
+    def test_AhoCorasick_keys_found_5(self):
+        self.assertEqual(
+            AhoCorasick(
+                ['c', 'aa', 'd']
+            ).are_keys_found_equal_to(
+                'bcdybc',
+                {
+                    'd': [2],
+                    'c': [1, 5]
+                }
+            ),
+            True
+        )
+
+    def test_AhoCorasick_keys_found_6(self):
+        self.assertEqual(
+            AhoCorasick(
+                ['a', 'ab', 'bab', 'bc', 'bca', 'c', 'ca', 'caa']
+            ).are_keys_found_equal_to(
+                'abcacaab',
+                {
+                    'a': [0, 3, 5, 6],
+                    'ab': [0, 6],
+                    'bc': [1],
+                    'bca': [1],
+                    'c': [2, 4],
+                    'ca': [2, 4],
+                    'caa': [4]
+                }
+            ),
+            True
+        )
+
+    def test_AhoCorasick_goto_1(self):
+        tree = AhoCorasick(
+            ['a', 'ab', 'bab', 'bc', 'bca', 'c', 'caa']
+        ).tree
+
+        self.assertEqual(
+            {
+                t: child.key
+                for t, child in tree.goto.items()
+            },
+            {
+                'a': 'a',
+                'b': 'b',
+                'c': 'c'
+            }
+        )
+        self.assertEqual(
+            {
+                child.key
+                for child in tree.goto['b'].goto.values()
+            },
+            {
+                child.key
+                for child in tree.goto['b'].childs
+            }
+        )
+
+    def test_AhoCorasick_dfa_1(self):
+        keys = ['a', 'ab', 'bab', 'bc', 'bca', 'c', 'caa']
+
+        for text in ['abccab', 'abcacaab', 'xyzbabca', '']:
+            self.assertEqual(
+                AhoCorasick(
+                    keys,
+                    mode='dfa'
+                ).are_keys_found_equal_to(
+                    text,
+                    AhoCorasick(keys).find_in(text)
+                ),
+                True
+            )
+
+    def test_AhoCorasick_dfa_2(self):
+        ac = AhoCorasick(
+            ['a', 'bc', 'de'],
+            mode='dfa',
+            max_dfa_alphabet=4
+        )
+
+        self.assertEqual(ac.mode, 'lazy')
+        self.assertEqual(ac.tree.delta, None)
+        self.assertEqual(
+            ac.are_keys_found_equal_to(
+                'abcde',
+                {
+                    'a': [0],
+                    'bc': [1],
+                    'de': [3]
+                }
+            ),
+            True
+        )
+
+    def test_AhoCorasick_keys_found_7(self):
+        self.assertEqual(
+            AhoCorasick(
+                ['aaa', 'a', 'aa', 'ba']
+            ).are_keys_found_equal_to(
+                'aaaba',
+                {
+                    'a': [0, 1, 2, 4],
+                    'aa': [0, 1],
+                    'aaa': [0],
+                    'ba': [3]
+                }
+            ),
+            True
+        )
+
+    def test_CompactAutomaton_1(self):
+        automaton = CompactAutomaton(
+            ['a', 'ab', 'bab', 'bc', 'bca', 'c', 'caa']
+        )
+        state = {}
+
+        for key in ['a', 'ab', 'b', 'ba', 'bab', 'bca', 'ca']:
+            s = 0
+
+            for t in key:
+                s = automaton.goto(s, automaton.alphabet[t])
+
+            state[key] = s
+
+        self.assertEqual(automaton.states(), 11)
+        self.assertEqual(automaton.fail[state['ab']], state['b'])
+        self.assertEqual(automaton.output[state['ab']], -1)
+        self.assertEqual(automaton.fail[state['bab']], state['ab'])
+        self.assertEqual(automaton.output[state['bab']], state['ab'])
+        self.assertEqual(automaton.fail[state['bca']], state['ca'])
+        self.assertEqual(automaton.output[state['bca']], state['a'])
+        self.assertEqual(
+            automaton.keys[
+                automaton.pattern[state['bca']]
+            ],
+            'bca'
+        )
+        self.assertEqual(automaton.pattern[state['ba']], -1)
+
+    def test_AhoCorasick_array_1(self):
+        cases = [
+            (['a', 'ab', 'bab', 'bc', 'bca', 'c', 'caa'], 'abcacaab'),
+            (['b', 'c', 'aa', 'd', 'b'], 'caaab'),
+            (['a', 'b', 'c', 'aa', 'd'], 'xyz'),
+            (['aaa', 'a', 'aa', 'ba'], 'aaaba'),
+            ([''], 'abc')
+        ]
+
+        for keys, text in cases:
+            for mode in ['lazy', 'dfa']:
+                self.assertEqual(
+                    AhoCorasick(
+                        keys,
+                        mode,
+                        backend='array'
+                    ).are_keys_found_equal_to(
+                        text,
+                        AhoCorasick(keys).find_in(text)
+                    ),
+                    True
+                )
+
+    def test_AhoCorasick_array_2(self):
+        ac = AhoCorasick(
+            ['he', 'she', 'his', 'hers'],
+            backend='array'
+        )
+
+        self.assertEqual(ac.tree, None)
+        self.assertEqual(
+            ac.dfa_memory_estimate(),
+            10 * 5 * ac.automaton.edge_offset.itemsize
+        )
+        self.assertEqual(
+            ac.automaton.bytes_per_state() > 0,
+            True
+        )
+
+    def test_AhoCorasick_save_load_1(self):
+        keys = ['a', 'ab', 'bab', 'bc', 'bca', 'c', 'caa', 'ĉa']
+        text = 'abcacaabĉaab'
+
+        with TemporaryDirectory() as directory:
+            path = join(directory, 'keys.ac')
+
+            for backend in ['node', 'array']:
+                for mode in ['lazy', 'dfa']:
+                    AhoCorasick(keys, mode, backend=backend).save(path)
+
+                    for mmap in [True, False]:
+                        ac = AhoCorasick.load(path, mmap)
+
+                        self.assertEqual(ac.mode, mode)
+                        self.assertEqual(
+                            ac.are_keys_found_equal_to(
+                                text,
+                                AhoCorasick(keys).find_in(text)
+                            ),
+                            True
+                        )
+
+                        del ac
+
+    def test_AhoCorasick_save_load_2(self):
+        with TemporaryDirectory() as directory:
+            path = join(directory, 'keys.ac')
+
+            with open(path, 'wb') as content:
+                content.write(
+                    FORMAT_HEADER.pack(
+                        FORMAT_MAGIC,
+                        FORMAT_VERSION + 1,
+                        0, 0, 0, 0, 0, 0, 0, 0, 0
+                    )
+                )
+
+            with self.assertRaises(ValueError):
+                AhoCorasick.load(path)
+
+            AhoCorasick(['a', 'ab', 'bc'], 'dfa').save(path)
+
+            with open(path, 'rb') as content:
+                data = content.read()
+
+            for size in [0, 30, FORMAT_HEADER.size, len(data) - 9]:
+                with open(path, 'wb') as content:
+                    content.write(data[:size])
+
+                for mmap in [True, False]:
+                    with self.assertRaisesRegex(ValueError, 'truncated'):
+                        AhoCorasick.load(path, mmap)
+
+    def test_StreamMatcher_1(self):
+        keys = ['a', 'ab', 'bab', 'bc', 'bca', 'c', 'caa']
+        text = 'abcacaabbabca'
+
+        for backend in ['node', 'array']:
+            for mode in ['lazy', 'dfa']:
+                ac = AhoCorasick(keys, mode, backend=backend)
+
+                for size in [1, 2, 5, len(text)]:
+                    matcher = ac.stream()
+                    output = defaultdict(list)
+
+                    for k in range(0, len(text), size):
+                        for start, end, key in matcher.feed(
+                            text[k:k + size]
+                        ):
+                            self.assertEqual(text[start:end], key)
+                            output[key].append(start)
+
+                    self.assertEqual(
+                        ac.are_keys_found_equal_to(text, output),
+                        True
+                    )
+
+    def test_StreamMatcher_2(self):
+        for backend in ['node', 'array', 'dna']:
+            for mode in ['lazy', 'dfa']:
+                ac = AhoCorasick(['acgtacgt', 't'], mode, backend=backend)
+
+                with ac.stream() as matcher:
+                    matcher.feed('acgtacg')
+                    ac.remove_keys(['acgtacgt'])
+
+                    self.assertEqual(
+                        matcher.feed('t'),
+                        [(0, 8, 'acgtacgt'), (7, 8, 't')]
+                    )
+
+                self.assertEqual(ac.snapshot.readers, 0)
+
+                ac = AhoCorasick(['act'], mode, backend=backend)
+                matcher = ac.stream()
+                matcher.feed('ac')
+                ac.remove_keys(['act'])
+                ac.add_keys(['act'])
+
+                self.assertEqual(matcher.feed('t'), [(0, 3, 'act')])
+
+                matcher.close()
+                ac.remove_keys(['act'])
+
+                self.assertEqual(matcher.feed('act'), [])
+                self.assertEqual(ac.snapshot.readers, 1)
+
+                matcher.close()
+
+                self.assertEqual(ac.snapshot.readers, 0)
+
+    def test_AhoCorasick_iter_file_matches_1(self):
+        ac = AhoCorasick(['bca', 'caa'])
+
+        with TemporaryDirectory() as directory:
+            path = join(directory, 'text.txt')
+
+            with open(path, 'w', encoding='utf-8') as content:
+                content.write('abcacaab')
+
+            self.assertEqual(
+                list(
+                    ac.iter_file_matches(path, block_size=3)
+                ),
+                [(1, 4, 'bca'), (4, 7, 'caa')]
+            )
+
+    def test_AhoCorasick_iter_matches_1(self):
+        ac = AhoCorasick(
+            ['a', 'ab', 'bab', 'bc', 'bca', 'c', 'caa']
+        )
+
         self.assertEqual(
-            AhoCorasick(
-                ['a', 'ab', 'bab', 'bc', 'bca', 'c', 'caa']
-            ).are_keys_found_equal_to(
-                'abcacaab',
-                {
-                    'a': [0, 3, 5, 6],
-                    'ab': [0, 6],
-                    'bc': [1],
-                    'bca': [1],
-                    'c': [2, 4],
-                    'caa': [4]
-                }
+            list(
+                ac.iter_matches('abccab')
             ),
-            True
+            [
+                (0, 1, 'a'),
+                (0, 2, 'ab'),
+                (1, 3, 'bc'),
+                (2, 3, 'c'),
+                (3, 4, 'c'),
+                (4, 5, 'a'),
+                (4, 6, 'ab')
+            ]
+        )
+        self.assertEqual(
+            ac.first_match('xxbcaa'),
+            (2, 4, 'bc')
         )
+        self.assertEqual(ac.first_match('xyz'), None)
+
+    def test_AhoCorasick_match_kind_1(self):
+        keys = ['a', 'ab', 'bab', 'bc', 'bca', 'c', 'caa']
+
+        for backend in ['node', 'array']:
+            for mode in ['lazy', 'dfa']:
+                ac = AhoCorasick(keys, mode, backend=backend)
+
+                self.assertEqual(
+                    list(
+                        ac.iter_matches('abccab', 'leftmost-longest')
+                    ),
+                    [(0, 2, 'ab'), (2, 3, 'c'), (3, 4, 'c'), (4, 6, 'ab')]
+                )
+                self.assertEqual(
+                    list(
+                        ac.iter_matches('abccab', 'leftmost-first')
+                    ),
+                    [(0, 1, 'a'), (1, 3, 'bc'), (3, 4, 'c'), (4, 5, 'a')]
+                )
+                self.assertEqual(
+                    ac.find_in('xbcaab', 'leftmost-longest'),
+                    {'bca': [1], 'ab': [4]}
+                )
+
+        ac = AhoCorasick(['b', 'abcd', 'bc'])
 
-    def test_AhoCorasick_keys_found_3(self):
         self.assertEqual(
-            AhoCorasick(
-                ['b', 'c', 'aa', 'd', 'b']
-            ).are_keys_found_equal_to(
-                'caaab',
+            list(
+                ac.iter_matches('abce', 'leftmost-first')
+            ),
+            [(1, 2, 'b')]
+        )
+        self.assertEqual(
+            list(
+                ac.iter_matches('abce', 'leftmost-longest')
+            ),
+            [(1, 3, 'bc')]
+        )
+        self.assertRaises(ValueError, ac.iter_matches, 'abce', 'shortest')
+
+    def test_AhoCorasick_replace_1(self):
+        replacements = {'he': 'HE', 'she': 'SHE', 'his': 'HIS', 'hers': '#'}
+        text = 'ushers say his name'
+
+        for backend in ['node', 'array']:
+            ac = AhoCorasick(replacements, backend=backend)
+
+            self.assertEqual(
+                ac.replace(text, replacements),
+                'uSHErs say HIS name'
+            )
+            self.assertEqual(
+                ac.replace(text, lambda key: '*' * len(key)),
+                'u***rs say *** name'
+            )
+
+            for size in range(1, len(text) + 1):
+                target = StringIO()
+
+                self.assertEqual(
+                    ac.replace_stream(
+                        [
+                            text[i:i+size]
+                            for i in range(0, len(text), size)
+                        ],
+                        replacements,
+                        target
+                    ),
+                    2
+                )
+                self.assertEqual(target.getvalue(), 'uSHErs say HIS name')
+
+            self.assertRaises(
+                ValueError,
+                ac.replace,
+                text,
+                replacements,
+                'standard'
+            )
+
+    def test_AhoCorasick_contains_any_1(self):
+        for backend in ['node', 'array']:
+            ac = AhoCorasick(['he', 'she'], backend=backend)
+
+            self.assertEqual(ac.contains_any('ushers'), True)
+            self.assertEqual(ac.contains_any('usurp'), False)
+            self.assertEqual(ac.contains_any(''), False)
+
+    def test_AhoCorasick_bytes_1(self):
+        keys = ['a', 'ab', 'bab', 'bc', 'bca', 'c', 'caa', 'é']
+        text = 'abcacaabéab'
+        data = text.encode('utf-8')
+        expected = {
+            key.encode('utf-8'): [
+                len(text[:start].encode('utf-8'))
+                for start in starts
+            ]
+            for key, starts in AhoCorasick(keys).find_in(text).items()
+        }
+
+        for backend in ['node', 'array']:
+            for mode in ['lazy', 'dfa']:
+                ac = AhoCorasick(
+                    [key.encode('utf-8') for key in keys],
+                    mode,
+                    backend=backend
+                )
+
+                for buffer in [
+                    data,
+                    bytearray(data),
+                    memoryview(data),
+                    array('B', data)
+                ]:
+                    self.assertEqual(
+                        ac.are_keys_found_equal_to(buffer, expected),
+                        True
+                    )
+
+    def test_AhoCorasick_bytes_2(self):
+        ac = AhoCorasick([b'caa', b'bc'], backend='array')
+
+        with TemporaryDirectory() as directory:
+            path = join(directory, 'keys.ac')
+            ac.save(path)
+            text_path = join(directory, 'text.bin')
+
+            with open(text_path, 'wb') as content:
+                content.write(b'xxbcaa')
+
+            with open(text_path, 'rb') as content:
+                with memory_map(
+                    content.fileno(),
+                    0,
+                    access=ACCESS_READ
+                ) as data:
+                    self.assertEqual(
+                        AhoCorasick.load(path).first_match(data),
+                        (2, 4, b'bc')
+                    )
+
+            self.assertEqual(
+                list(
+                    ac.iter_file_matches(text_path, block_size=4)
+                ),
+                [(2, 4, b'bc'), (3, 6, b'caa')]
+            )
+
+        with self.assertRaises(TypeError):
+            ac.find_in('caa')
+
+        with self.assertRaises(TypeError):
+            AhoCorasick(['caa']).find_in(b'caa')
+
+        with self.assertRaises(TypeError):
+            AhoCorasick(['caa', b'bc'])
+
+    def test_AhoCorasick_find_in_parallel_1(self):
+        keys = ['a', 'ab', 'bab', 'bc', 'bca', 'c', 'caa']
+        text = 'abcacaabbabca' * 7
+
+        for ac in [
+            AhoCorasick(keys),
+            AhoCorasick([key.encode() for key in keys], backend='array')
+        ]:
+            if ac.binary:
+                text = text.encode()
+
+            self.assertEqual(
+                ac.are_keys_found_equal_to(
+                    text,
+                    ac.find_in_parallel(text, workers=4)
+                ),
+                True
+            )
+
+    def test_AhoCorasick_find_in_many_1(self):
+        ac = AhoCorasick(['a', 'ab', 'bab', 'bc', 'bca', 'c', 'caa'])
+        documents = ['abccab', 'abcacaab', 'xyz', '', 'babca'] * 5
+        expected = [ac.find_in(document) for document in documents]
+
+        for executor in ['process', 'thread']:
+            self.assertEqual(
+                list(
+                    ac.find_in_many(
+                        iter(documents),
+                        workers=2,
+                        chunksize=3,
+                        executor=executor
+                    )
+                ),
+                expected
+            )
+            self.assertEqual(
+                sorted(
+                    ac.find_in_many(
+                        documents,
+                        workers=2,
+                        chunksize=2,
+                        ordered=False,
+                        executor=executor
+                    ),
+                    key=lambda item: item[0]
+                ),
+                list(
+                    enumerate(expected)
+                )
+            )
+
+        # A long first document finishes after the short ones.
+        found = ac.find_in_many(
+            ['ab' * 200000, 'ab', 'bc'],
+            workers=2,
+            chunksize=1,
+            ordered=False,
+            executor='thread'
+        )
+
+        self.assertEqual(next(found)[0] > 0, True)
+
+    def test_AhoCorasick_stats_1(self):
+        keys = ['a', 'ab', 'bab', 'bc', 'bca', 'c', 'caa']
+
+        for backend in ['node', 'array']:
+            ac = AhoCorasick(keys, backend=backend, stats=True)
+
+            self.assertEqual(
+                ac.are_keys_found_equal_to(
+                    'abccab',
+                    AhoCorasick(keys).find_in('abccab')
+                ),
+                True
+            )
+            self.assertEqual(
                 {
-                    'aa': [1, 2],
-                    'b': [4],
-                    'c': [0]
+                    counter: value
+                    for counter, value in ac.stats.as_dict().items()
+                    if not counter.startswith('build_seconds.')
+                },
+                {
+                    'characters': 6,
+                    'goto_hits': 6,
+                    'failure_hops': 4,
+                    'output_links': 2,
+                    'matches': 7
                 }
-            ),
-            True
+            )
+
+            ac.stats.reset()
+            ac = AhoCorasick(keys, 'dfa', backend=backend, stats=True)
+            ac.find_in('abccab')
+
+            self.assertEqual(ac.stats.failure_hops, 0)
+            self.assertEqual(ac.stats.goto_hits, 6)
+            self.assertEqual(
+                'build_seconds.dfa' in ac.stats.as_dict(),
+                True
+            )
+
+    def test_AhoCorasick_stats_2(self):
+        ac = AhoCorasick(['a', 'ab'])
+
+        self.assertEqual(ac.stats, None)
+        self.assertEqual(
+            set(ac.build_seconds),
+            {'trie', 'links'}
         )
 
-    def test_AhoCorasick_keys_found_4(self):
+    def test_AhoCorasick_update_keys_1(self):
+        keys = ['a', 'ab', 'bab', 'bc', 'bca', 'c', 'caa']
+
+        for snapshot in [True, False]:
+            ac = AhoCorasick(['bc', 'caa'])
+            tree = ac.tree
+            scan = ac.scan('bcaa')
+            next(scan)
+            ac.add_keys(['a', 'ab', 'bab', 'bca', 'c'], snapshot)
+
+            self.assertEqual(ac.tree == AhoCorasick(keys).tree, True)
+            self.assertEqual(tree is ac.tree, not snapshot)
+
+            scan.close()
+            tree = ac.tree
+            ac.remove_keys(['bab', 'c', 'x'], snapshot)
+
+            self.assertEqual(tree is ac.tree, True)
+            self.assertEqual(ac.snapshot.readers, 0)
+
+            self.assertEqual(
+                ac.tree == AhoCorasick(
+                    ['a', 'ab', 'bc', 'bca', 'caa']
+                ).tree,
+                True
+            )
+
+    def test_AhoCorasick_update_keys_2(self):
+        rng = Random(2)
+
+        for backend, mode in [
+            ('node', 'lazy'),
+            ('node', 'dfa'),
+            ('array', 'dfa')
+        ]:
+            for snapshot in [True, False]:
+                ac = AhoCorasick([], mode, backend=backend)
+                keys = set()
+
+                for _ in range(30):
+                    added = [
+                        ''.join(
+                            rng.choices('abc', k=rng.randint(1, 4))
+                        )
+                        for _ in range(rng.randint(0, 4))
+                    ]
+                    removed = rng.sample(
+                        sorted(keys),
+                        min(len(keys), rng.randint(0, 3))
+                    )
+                    ac.update_keys(added, removed, snapshot)
+                    keys.difference_update(removed)
+                    keys.update(added)
+                    text = ''.join(rng.choices('abcd', k=30))
+                    fresh = AhoCorasick(keys, mode, backend=backend)
+
+                    self.assertEqual(
+                        ac.are_keys_found_equal_to(
+                            text,
+                            fresh.find_in(text)
+                        ),
+                        True
+                    )
+
+                    if backend == 'node':
+                        self.assertEqual(ac.tree == fresh.tree, True)
+
+    def test_AhoCorasick_update_keys_3(self):
+        for backend in ['node', 'array']:
+            ac = AhoCorasick({'ab': 1, 'a': 2, 'b': 3}, backend=backend)
+            matches = ac.iter_matches('xxab ab', 'leftmost-first')
+            next(matches)
+            ac.remove_keys(['ab'])
+
+            self.assertEqual(list(matches), [(5, 7, 'ab')])
+            self.assertEqual(ac.payloads, {'a': 2, 'b': 3})
+            self.assertEqual(ac.priority, {'a': 1, 'b': 2})
+
+            matches = ac.iter_matches('abab')
+            next(matches)
+            ac.add_keys(['ba'])
+
+            self.assertEqual(
+                list(matches),
+                [(1, 2, 'b'), (2, 3, 'a'), (3, 4, 'b')]
+            )
+
+        ac = AhoCorasick({'ac': 1}, backend='dna')
+        snapshot = ac.snapshot
+
+        with self.assertRaises(ValueError):
+            ac.add_keys({'gt': 2, 'an': 3})
+
+        self.assertEqual(ac.snapshot is snapshot, True)
+        self.assertEqual(ac.payloads, {'ac': 1})
+
+    def test_AhoCorasick_count_in_1(self):
+        keys = {'a': 1, 'ab': 10, 'bab': 100, 'bc': 1000, 'bca': 3, 'c': 5}
+        text = 'abcacaabbabca'
+
+        for backend in ['node', 'array']:
+            ac = AhoCorasick(keys, backend=backend)
+            counts = {
+                key: len(starts)
+                for key, starts in ac.find_in(text).items()
+            }
+
+            self.assertEqual(ac.count_in(text), counts)
+            self.assertEqual(ac.keys_in(text), set(counts))
+            self.assertEqual(
+                ac.score_in(text),
+                sum(keys[key] * count for key, count in counts.items())
+            )
+            self.assertEqual(
+                ac.score_in(text, {'c': 2}),
+                2 * counts['c']
+            )
+            self.assertEqual(ac.count_in('xyz'), {})
+            self.assertEqual(ac.score_in('xyz'), 0)
+
+    def test_AutomatonCache_1(self):
+        keys = ['he', 'she', 'his', 'hers']
+        cache = AutomatonCache(max_states=20)
+        ac = cache.get(keys)
+
+        self.assertEqual(ac.states(), 10)
+        self.assertEqual(cache.get(keys[::-1]) is ac, True)
+        self.assertEqual(cache.get(keys, mode='dfa') is ac, False)
+        self.assertEqual(cache.get(keys) is ac, True)
+
+        cache.get(['abc', 'abd'])
+
         self.assertEqual(
-            AhoCorasick(
-                ['a', 'b', 'c', 'aa', 'd']
-            ).are_keys_found_equal_to(
-                'xyz',
-                {}
+            cache.info(),
+            {
+                'hits': 2,
+                'misses': 3,
+                'evictions': 1,
+                'entries': 2,
+                'states': 15,
+                'bytes': 0
+            }
+        )
+        self.assertEqual(cache.get(keys, mode='dfa') is ac, False)
+        self.assertEqual(
+            len(
+                AutomatonCache(max_states=5).get(keys).find_in('ushers')
             ),
-            True
+            3
         )
-
-    def test_AhoCorasick_keys_found_5(self):
         self.assertEqual(
-            AhoCorasick(
-                ['c', 'aa', 'd']
-            ).are_keys_found_equal_to(
-                'bcdybc',
+            digest_keys({'a': 1, 'b': 2}),
+            digest_keys({'b': 2, 'a': 1})
+        )
+        self.assertEqual(
+            len(
                 {
-                    'd': [2],
-                    'c': [1, 5]
+                    digest_keys(['a', 'b']),
+                    digest_keys(['ab']),
+                    digest_keys({'a': 1, 'b': 2}),
+                    digest_keys({'a': 1, 'b': 3}),
+                    digest_keys([b'a', b'b'])
                 }
             ),
-            True
+            5
         )
 
-    def test_AhoCorasick_keys_found_6(self):
+        cache = AutomatonCache()
+        ac = cache.get(key for key in keys)
+
+        self.assertEqual(ac.states(), 10)
+        self.assertEqual(cache.get(keys) is ac, True)
+
+    def test_AhoCorasick_dna_1(self):
+        keys = ['a', 'ac', 'gat', 'tac', 'aca', 'c']
+        text = 'gattacaxacNacé'
+        ac = AhoCorasick(keys, backend='dna')
+
+        self.assertEqual(
+            ac.find_in(text),
+            AhoCorasick(keys).find_in(text)
+        )
+        self.assertEqual(
+            ac.find_in(text)['ac'],
+            [4, 8, 11]
+        )
         self.assertEqual(
             AhoCorasick(
-                ['a', 'ab', 'bab', 'bc', 'bca', 'c', 'ca', 'caa']
-            ).are_keys_found_equal_to(
-                'abcacaab',
+                [key.encode() for key in keys],
+                backend='dna'
+            ).find_in(b'gattaca'),
+            AhoCorasick(
+                [key.encode() for key in keys]
+            ).find_in(b'gattaca')
+        )
+        self.assertRaises(
+            ValueError,
+            AhoCorasick,
+            ['acgu'],
+            backend='dna'
+        )
+
+        for strand in ['', 'g', 'gattaca', 'acgtacgt']:
+            self.assertEqual(
+                len(
+                    pack_bases(strand)
+                ),
+                (len(strand) + 3) // 4
+            )
+            self.assertEqual(
+                unpack_bases(
+                    pack_bases(strand),
+                    len(strand)
+                ),
+                strand
+            )
+
+        self.assertRaises(ValueError, pack_bases, 'gatNaca')
+
+        strand = 'gattacagattacaacgt' * 3
+        packed = PackedStrand.pack(strand)
+
+        self.assertEqual(ac.find_in(packed), ac.find_in(strand))
+        self.assertEqual(
+            list(
+                ac.iter_matches(packed, 'leftmost-longest')
+            ),
+            list(
+                ac.iter_matches(strand, 'leftmost-longest')
+            )
+        )
+        self.assertEqual(packed[3:11], strand[3:11])
+        self.assertEqual(packed[-1], strand[-1])
+        self.assertRaises(TypeError, AhoCorasick(keys).find_in, packed)
+        self.assertRaises(ValueError, PackedStrand, b'ac', 9)
+
+    @skipIf(numpy is None, 'numpy is not installed')
+    def test_BatchScanner_1(self):
+        keys = {'a': 1, 'ab': 10, 'bab': 100, 'bc': 1000, 'c': 5}
+        texts = ['abcab', 'babca', 'xxxxx', 'cécbc']
+
+        for backend in ['node', 'array']:
+            for mode in ['lazy', 'dfa']:
+                ac = AhoCorasick(keys, mode, backend=backend)
+                scanner = ac.batch()
+                counts = scanner.counts(texts)
+
+                self.assertEqual(counts.shape, (4, 5))
+
+                for row, text in enumerate(texts):
+                    self.assertEqual(
+                        {
+                            key: counts[row, column]
+                            for column, key in enumerate(scanner.keys)
+                            if counts[row, column]
+                        },
+                        ac.count_in(text)
+                    )
+
+                self.assertEqual(
+                    scanner.scores(texts).tolist(),
+                    [ac.score_in(text) for text in texts]
+                )
+
+        self.assertRaises(
+            ValueError,
+            AhoCorasick(keys).batch().counts,
+            ['ab', 'abc']
+        )
+
+    def test_Searcher_1(self):
+        keys = ['a', 'ab', 'bab', 'bc', 'bca', 'c', 'caa', '', 'a']
+        text = 'abcacaabbabca'
+        found = AhoCorasick(keys).find_in(text)
+
+        for engine in SEARCH_ENGINES:
+            self.assertEqual(
+                Searcher(keys, engine).find_in(text),
+                found
+            )
+            self.assertEqual(
+                Searcher(
+                    [key.encode() for key in keys],
+                    engine
+                ).find_in(
+                    memoryview(text.encode())
+                ),
                 {
-                    'a': [0, 3, 5, 6],
-                    'ab': [0, 6],
-                    'bc': [1],
-                    'bca': [1],
-                    'c': [2, 4],
-                    'ca': [2, 4],
-                    'caa': [4]
+                    key.encode(): starts
+                    for key, starts in found.items()
                 }
-            ),
-            True
+            )
+
+        self.assertEqual(Searcher(keys).engine, 'find')
+        self.assertEqual(
+            Searcher(
+                [f'{i:03}' for i in range(100)],
+                mode='dfa'
+            ).engine,
+            'aho-corasick'
+        )
+        self.assertRaises(ValueError, Searcher, keys, 'wu-manber')
+
+    def test_SuffixArray_1(self):
+        text = 'abcacaabbabca'
+        keys = ['a', 'ab', 'bab', 'bc', 'bca', 'c', 'caa', 'x', '']
+        index = SuffixArray(text)
+
+        self.assertEqual(
+            list(index.sa),
+            sorted(
+                range(len(text)),
+                key=lambda i: text[i:]
+            )
+        )
+        self.assertEqual(
+            index.find_in(keys),
+            AhoCorasick(keys).find_in(text)
+        )
+        self.assertEqual(index.count('a'), 6)
+        self.assertEqual(index.locate('bca'), [1, 10])
+        self.assertEqual(
+            SuffixArray(text.encode()).find_in([b'ab', b'ca']),
+            {b'ab': [0, 6, 9], b'ca': [2, 4, 11]}
         )
+        self.assertRaises(TypeError, index.find_in, [b'ab'])
+
+        with TemporaryDirectory() as directory:
+            path = join(directory, 'text.sa')
+            index.save(path)
+
+            for mmap in [True, False]:
+                self.assertEqual(
+                    SuffixArray.load(path, mmap).find_in(keys),
+                    index.find_in(keys)
+                )
+
+            with open(path, 'rb') as content:
+                data = content.read()
+
+            for size in [0, SUFFIX_HEADER.size, len(data) - 9]:
+                with open(path, 'wb') as content:
+                    content.write(data[:size])
+
+                for mmap in [True, False]:
+                    with self.assertRaisesRegex(ValueError, 'truncated'):
+                        SuffixArray.load(path, mmap)
+
+    def test_ShardedMatcher_1(self):
+        keys = ['a', 'ab', 'bab', 'bc', 'bca', 'c', 'caa', 'é', '']
+        text = 'abcacaabbabcaé'
+        found = AhoCorasick(keys).find_in(text)
+
+        with TemporaryDirectory() as directory:
+            matcher = ShardedMatcher.build(keys, directory, 3)
+
+            self.assertEqual(len(matcher.paths), 3)
+            self.assertEqual(
+                sorted(
+                    len(AhoCorasick.load(path).automaton.keys)
+                    for path in matcher.paths
+                ),
+                sorted(
+                    [
+                        sum(
+                            ShardedMatcher.shard_of(key, 3) == k
+                            for key in keys
+                            if key
+                        )
+                        for k in range(3)
+                    ]
+                )
+            )
+            self.assertEqual(matcher.find_in(text), found)
+            self.assertEqual(
+                ShardedMatcher.open(directory).find_in(text, workers=2),
+                found
+            )
+
+        with TemporaryDirectory() as directory:
+            matcher = ShardedMatcher.build([b'ab', b'cd'], directory, 8)
+
+            self.assertEqual(len(matcher.paths), 2)
+            self.assertEqual(
+                matcher.find_in(b'abcd'),
+                {b'ab': [0], b'cd': [2]}
+            )
+            self.assertRaises(
+                TypeError,
+                ShardedMatcher.build,
+                ['ab', b'cd'],
+                directory,
+                8
+            )
 
 
 if __name__ == '__main__':